@@ -0,0 +1,76 @@
+import random
+import numpy as np
+from PIL import Image
+
+# Vertical alpha ramps, one per image height. The gradient only varies by row, so it is rendered
+# as a 1 pixel wide column and stretched to the full width natively instead of building the
+# mask pixel by pixel.
+_ramp_cache = {}
+
+def get_gradient_ramp(height):
+    ramp = _ramp_cache.get(height)
+    if ramp is None:
+        ramp = Image.frombytes('L', (1, height), bytes(int(255 * (y / height)) for y in range(height)))
+        _ramp_cache[height] = ramp
+    return ramp
+
+def random_gradient_colors(rng=random):
+    def random_color_within_range(base_color, variation):
+        return tuple(
+            max(0, min(255, base_color[i] + rng.randint(-variation, variation))) for i in range(3)
+        )
+
+    base_color = tuple(rng.randint(50, 100) for _ in range(3))  # base darker color
+    variation = 25  # variation range to keep colors close
+
+    start_color = random_color_within_range(base_color, variation)
+    end_color = random_color_within_range(base_color, variation)
+    return start_color, end_color
+
+def render_gradient_column(height, start_color, end_color):
+    ramp = get_gradient_ramp(height)
+    column = Image.new('RGBA', ramp.size, start_color)
+    column.paste(Image.new('RGBA', ramp.size, end_color), (0, 0), ramp)
+    return column
+
+def render_gradient(image_size, start_color, end_color):
+    return render_gradient_column(image_size[1], start_color, end_color).resize(image_size, Image.NEAREST)
+
+def generate_random_gradient(image_size, rng=random):
+    start_color, end_color = random_gradient_colors(rng)
+    return render_gradient(image_size, start_color, end_color)
+
+class BackgroundPool:
+    # Pre-rendered gradients that are sampled instead of rendered per image. Without a color shift
+    # a sample is a copy of a full size background, about a third of the cost of stretching a fresh
+    # gradient. color_shift adds a random per-channel offset so a small pool still varies; it is
+    # applied to the 1 pixel column and only then stretched, so a shifted sample costs about what a
+    # fresh gradient does (the stretch dominates both). Backends that stretch the gradient
+    # themselves take the column directly.
+    def __init__(self, image_size, pool_size, color_shift=0, rng=random):
+        self.image_size = image_size
+        self.color_shift = color_shift
+        self.columns = [render_gradient_column(image_size[1], *random_gradient_colors(rng)) for _ in range(pool_size)]
+        if color_shift <= 0:
+            self.backgrounds = [column.resize(image_size, Image.NEAREST) for column in self.columns]
+        else:
+            # Signed copies so an offset can be added and clipped without wrapping
+            self.column_arrays = [np.asarray(column, np.int16) for column in self.columns]
+
+    def sample(self, rng=random):
+        if self.color_shift <= 0:
+            return self._shift(self.backgrounds, rng)
+        return self._shift(self.columns, rng).resize(self.image_size, Image.NEAREST)
+
+    def sample_column(self, rng=random):
+        # Same draws as sample, so either one picks the same background for the same seed
+        return self._shift(self.columns, rng)
+
+    def _shift(self, images, rng):
+        index = rng.choice(range(len(images)))
+        if self.color_shift <= 0:
+            return images[index].copy()
+
+        shift = np.array([rng.randint(-self.color_shift, self.color_shift) for _ in range(3)] + [0], np.int16)  # alpha untouched
+        column = np.clip(self.column_arrays[index] + shift, 0, 255).astype(np.uint8)
+        return Image.frombytes('RGBA', (1, column.shape[0]), column.tobytes())
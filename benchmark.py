@@ -0,0 +1,147 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from PIL import Image, ImageEnhance
+
+from factory_helpers import generate_dataset, get_card_images
+from backgrounds import BackgroundPool, generate_random_gradient
+from output_writer import encode_image, write_file
+
+deck_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deck', 'fire')
+image_size = (1024, 768)
+
+# name -> generate_dataset keyword overrides on top of the GUI defaults
+scenarios = {
+    'default': {},
+    'cards_only': {'include_active_players': False, 'include_seated_players': False, 'include_dealer_button': False},
+    'no_dealer_button': {'include_dealer_button': False},
+    'no_variation': {'brightness_range': 0, 'size_variation': 0},
+    'numpy_backend': {'render_backend': 'numpy'},
+    'grain': {'grain_range': 0.3},
+}
+
+def run_scenario(num_images, workers, overrides):
+    options = {
+        'brightness_range': 0.4, 'grain_range': 0, 'size_variation': 0.25, 'include_active_players': True,
+        'include_seated_players': True, 'include_dealer_button': True, 'render_backend': 'pil',
+    }
+    options.update(overrides)
+    output_dir = tempfile.mkdtemp(prefix='imagefactory_bench_')
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_dataset(deck_path, 'fire', num_images, 0.7, 0.2, 0.1, options['brightness_range'],
+                             options['grain_range'], options['size_variation'], False, options['include_active_players'],
+                             options['include_seated_players'], options['include_dealer_button'], 'yolov8',
+                             workers=workers, seed=0, output_dir=output_dir, show_progress=False,
+                             render_backend=options['render_backend'])
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return num_images / elapsed
+
+def time_stage(func, repeat):
+    # Median milliseconds per call; the median is less sensitive to a noisy neighbour than the mean
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def run_stage_benchmarks(repeat):
+    rng = random.Random(0)
+    card = get_card_images(deck_path)['AS']
+    scaled_card = card.resize((int(card.width * 1.1), int(card.height * 1.1)), Image.LANCZOS)
+    canvas = generate_random_gradient(image_size, rng)
+    background_pool = BackgroundPool(image_size, 8, 0, rng)
+    shifted_pool = BackgroundPool(image_size, 8, 10, rng)
+    encoded = encode_image(canvas)
+    output_dir = tempfile.mkdtemp(prefix='imagefactory_bench_')
+    try:
+        stages = {
+            'background': lambda: generate_random_gradient(image_size, rng),
+            'background_pool': lambda: background_pool.sample(rng),
+            'background_pool_shifted': lambda: shifted_pool.sample(rng),
+            'resize': lambda: card.resize((int(card.width * 1.1), int(card.height * 1.1)), Image.LANCZOS),
+            'brightness': lambda: ImageEnhance.Brightness(scaled_card).enhance(1.2),
+            'paste': lambda: canvas.paste(scaled_card, (400, 300), scaled_card),
+            'encode_png': lambda: encode_image(canvas),
+            'write': lambda: write_file(os.path.join(output_dir, 'sample.png'), encoded),
+        }
+        return {name: time_stage(func, repeat) for name, func in stages.items()}
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+def run_benchmarks(num_images, worker_counts, repeat):
+    results = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                 'num_images': num_images},
+        'end_to_end': {},
+        'stages': run_stage_benchmarks(repeat),
+    }
+    for name, overrides in scenarios.items():
+        for workers in worker_counts:
+            key = f'{name}/workers={workers}'
+            results['end_to_end'][key] = run_scenario(num_images, workers, overrides)
+            print(f"{key:40s} {results['end_to_end'][key]:8.1f} img/s")
+    for name, ms in results['stages'].items():
+        print(f"{'stage/' + name:40s} {ms:8.3f} ms")
+    return results
+
+def compare(results, baseline, threshold):
+    # Throughput regresses when it drops, stage timings when they grow
+    regressions = []
+    for key, value in results['end_to_end'].items():
+        base = baseline.get('end_to_end', {}).get(key)
+        if base and value < base * (1 - threshold):
+            regressions.append(f"{key}: {value:.1f} img/s vs baseline {base:.1f} img/s")
+    for key, value in results['stages'].items():
+        base = baseline.get('stages', {}).get(key)
+        if base and value > base * (1 + threshold):
+            regressions.append(f"stage/{key}: {value:.3f} ms vs baseline {base:.3f} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ImageFactory against the bundled fire deck")
+    parser.add_argument('--num-images', type=int, default=100, help="Images per end-to-end scenario")
+    parser.add_argument('--workers', default=None,
+                        help="Comma separated worker counts (default: 1 and the CPU count)")
+    parser.add_argument('--repeat', type=int, default=20, help="Calls per stage microbenchmark")
+    parser.add_argument('--out', default=None, help="Write results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="Compare against a stored results JSON file")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Allowed slowdown before flagging (0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        worker_counts = [int(workers) for workers in args.workers.split(',')]
+    else:
+        worker_counts = sorted({1, os.cpu_count() or 1})
+
+    results = run_benchmarks(args.num_images, worker_counts, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
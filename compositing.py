@@ -0,0 +1,156 @@
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from backgrounds import generate_random_gradient, random_gradient_colors, render_gradient_column
+from sprite_cache import resample_sprite
+
+# Render backends own the canvas for one image at a time. render_random_card_combination drives them
+# with the same RNG draws and layout, so both backends produce identical labels for the same seed.
+
+class PILBackend:
+    name = 'pil'
+
+    def begin(self, image_size, rng, background_pool=None):
+        if background_pool is not None:
+            self.canvas = background_pool.sample(rng)
+        else:
+            self.canvas = generate_random_gradient(image_size, rng)
+
+    def resize(self, asset_key, image, scale, sprite_cache=None, transform=None):
+        if sprite_cache is not None:
+            return sprite_cache.resize(asset_key, image, scale, transform=transform)
+        return resample_sprite(image, (int(image.width * scale), int(image.height * scale)), transform)
+
+    def brighten(self, sprite, factor):
+        return ImageEnhance.Brightness(sprite).enhance(factor)
+
+    def composite(self, sprite, position):
+        self.canvas.paste(sprite, position, sprite)
+
+    def add_grain(self, noise_bank, rng, grain_range):
+        pixels = np.array(self.canvas)
+        noise_bank.apply(pixels, rng, grain_range)
+        self.canvas = Image.fromarray(pixels)
+
+    def finish(self):
+        canvas, self.canvas = self.canvas, None
+        return canvas
+
+class NumpySprite:
+    # A resampled sprite in the form the NumPy backend blends with: 8 bit color premultiplied by alpha
+    # and 255 - alpha for the canvas side. Both are 4 channels wide to match the RGBX canvas, since
+    # contiguous 4 channel arrays blend several times faster than strided RGB slices; the fourth
+    # channel keeps the canvas padding at 255. 8 bytes a pixel keeps the sprite cache effective.
+    __slots__ = ('width', 'height', 'size', 'premultiplied', 'inverse_alpha', 'nbytes')
+
+    def __init__(self, image):
+        rgba = np.asarray(image.convert('RGBA'), dtype=np.uint16)
+        alpha = rgba[..., 3:].copy()
+        self.width, self.height = image.size
+        self.size = image.size
+        rgba[..., 3] = 255
+        # rgba * alpha / 255, rounded, with shifts instead of an integer division
+        rgba *= alpha
+        rgba += 128
+        rgba += rgba >> 8
+        rgba >>= 8
+        self.premultiplied = rgba.astype(np.uint8)
+        self.inverse_alpha = np.repeat(255 - alpha.astype(np.uint8), 4, axis=2)
+        self.nbytes = self.premultiplied.nbytes + self.inverse_alpha.nbytes
+
+class ShadedSprite:
+    # A cached sprite plus the brightness to apply while blending, so brightening never copies it
+    __slots__ = ('sprite', 'brightness', 'width', 'height', 'size')
+
+    def __init__(self, sprite, brightness):
+        self.sprite = sprite
+        self.brightness = brightness
+        self.width, self.height, self.size = sprite.width, sprite.height, sprite.size
+
+class NumpyBackend:
+    # Keeps one preallocated HxWx4 uint8 RGBX canvas per worker and alpha-blends sprites straight into
+    # it with reusable integer scratch buffers: no per-sprite image copies, no brightness intermediates.
+    # The canvas is opaque, so output images are RGB where the PIL backend writes RGBA.
+    name = 'numpy'
+
+    def __init__(self):
+        self.canvas = None
+        self.scratch = [np.empty(0, np.uint16) for _ in range(3)]
+
+    def begin(self, image_size, rng, background_pool=None):
+        width, height = image_size
+        if self.canvas is None or self.canvas.shape[:2] != (height, width):
+            self.canvas = np.empty((height, width, 4), np.uint8)
+        if background_pool is not None:
+            column = background_pool.sample_column(rng)
+        else:
+            column = render_gradient_column(height, *random_gradient_colors(rng))
+        # The gradient only varies by row: fill whole pixels at once through a uint32 view
+        self.canvas.view(np.uint32)[..., 0] = np.frombuffer(column.tobytes(), np.uint32)[:, None]
+
+    def resize(self, asset_key, image, scale, sprite_cache=None, transform=None):
+        if sprite_cache is not None:
+            return sprite_cache.resize(asset_key, image, scale, prepare=NumpySprite, transform=transform)
+        return NumpySprite(resample_sprite(image, (int(image.width * scale), int(image.height * scale)), transform))
+
+    def brighten(self, sprite, factor):
+        return ShadedSprite(sprite, factor)
+
+    def composite(self, sprite, position):
+        brightness = 1.0
+        if isinstance(sprite, ShadedSprite):
+            sprite, brightness = sprite.sprite, sprite.brightness
+
+        # Clip to the canvas the same way Image.paste does
+        canvas_height, canvas_width = self.canvas.shape[:2]
+        x, y = position
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + sprite.width, canvas_width), min(y + sprite.height, canvas_height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        sprite_region = np.s_[y0 - y:y1 - y, x0 - x:x1 - x]
+        inverse_alpha = sprite.inverse_alpha[sprite_region]
+        region = self.canvas[y0:y1, x0:x1]
+
+        # Fixed point blend in uint16: canvas * (255 - alpha) + premultiplied * 255, divided by 255
+        blended = self._scratch(0, y1 - y0, x1 - x0)
+        shaded = self._scratch(1, y1 - y0, x1 - x0)
+        blended[...] = region
+        np.multiply(blended, inverse_alpha, out=blended)
+        shaded[...] = sprite.premultiplied[sprite_region]
+        if brightness != 1.0:
+            # Brightness in 1/128 steps, clipped to alpha like PIL clips brightened color to 255
+            np.multiply(shaded, min(round(brightness * 128), 257), out=shaded)
+            np.right_shift(shaded, 7, out=shaded)
+            if brightness > 1.0:
+                alpha = self._scratch(2, y1 - y0, x1 - x0)
+                np.subtract(255, inverse_alpha, out=alpha)
+                np.minimum(shaded, alpha, out=shaded)
+        np.multiply(shaded, 255, out=shaded)
+        np.add(blended, shaded, out=blended)
+        np.add(blended, 128, out=blended)
+        np.right_shift(blended, 8, out=shaded)
+        np.add(blended, shaded, out=blended)
+        np.right_shift(blended, 8, out=blended)
+        np.copyto(region, blended, casting='unsafe')
+
+    def add_grain(self, noise_bank, rng, grain_range):
+        noise_bank.apply(self.canvas, rng, grain_range)
+
+    def finish(self):
+        # frombytes unpacks a copy without the padding channel, so the canvas can be reused while the
+        # writer encodes this image
+        height, width = self.canvas.shape[:2]
+        return Image.frombytes('RGB', (width, height), self.canvas, 'raw', 'RGBX')
+
+    def _scratch(self, slot, height, width):
+        # Flat buffers reshaped per call, so every view is contiguous whatever the sprite size
+        size = height * width * 4
+        if self.scratch[slot].size < size:
+            self.scratch[slot] = np.empty(size, np.uint16)
+        return self.scratch[slot][:size].reshape(height, width, 4)
+
+render_backends = {
+    'pil': PILBackend,
+    'numpy': NumpyBackend,
+}
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from PIL import Image
+
+# A compiled deck is every PNG under <deck>/assets decoded once into a single raw RGBA file, plus a
+# JSON index of offsets and sizes. Workers memory-map the file read-only and wrap each asset with
+# Image.frombuffer, so loading is near-instant and the OS shares the pages between processes
+# instead of every worker holding its own decoded copy.
+#
+# The index records the mtime and size of every source PNG; adding, removing or touching an asset
+# makes the atlas stale. The raw file is named after a hash of that signature and the index is
+# written last, so a half-written compile is never picked up. Both go through a temporary file of
+# their own, so two processes compiling the same deck at once never write into each other's.
+atlas_dir_name = 'compiled'
+atlas_index_name = 'atlas.json'
+atlas_version = 1
+atlas_alignment = 64
+
+def asset_sources(deck_path):
+    # relative path -> [mtime_ns, size] for every PNG under assets/
+    assets_dir = os.path.join(deck_path, 'assets')
+    sources = {}
+    for root, dirs, files in os.walk(assets_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith('.png'):
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                sources[os.path.relpath(path, assets_dir).replace(os.sep, '/')] = [stat.st_mtime_ns, stat.st_size]
+    return sources
+
+def sources_signature(sources):
+    return hashlib.sha1(json.dumps(sources, sort_keys=True).encode()).hexdigest()[:16]
+
+def read_atlas_index(deck_path):
+    try:
+        with open(os.path.join(deck_path, atlas_dir_name, atlas_index_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def atlas_is_fresh(deck_path, index=None, sources=None):
+    index = index if index is not None else read_atlas_index(deck_path)
+    if index is None or index.get('version') != atlas_version:
+        return False
+    sources = sources if sources is not None else asset_sources(deck_path)
+    return index['signature'] == sources_signature(sources) and \
+        os.path.exists(os.path.join(deck_path, atlas_dir_name, index['data']))
+
+def compile_deck_atlas(deck_path, force=False):
+    # Returns True if the atlas was (re)built, False if it was already up to date
+    sources = asset_sources(deck_path)
+    if not sources:
+        raise FileNotFoundError(f"No PNG assets found in {os.path.join(deck_path, 'assets')}")
+    if not force and atlas_is_fresh(deck_path, sources=sources):
+        return False
+
+    atlas_dir = os.path.join(deck_path, atlas_dir_name)
+    os.makedirs(atlas_dir, exist_ok=True)
+    signature = sources_signature(sources)
+    data_name = f'atlas-{signature}.rgba'
+    entries = {}
+
+    def write_data(f):
+        offset = 0
+        for name in sources:
+            with Image.open(os.path.join(deck_path, 'assets', name)) as image:
+                pixels = image.convert('RGBA').tobytes()
+                size = image.size
+            padding = -offset % atlas_alignment
+            f.write(b'\0' * padding)
+            offset += padding
+            entries[name] = {'offset': offset, 'width': size[0], 'height': size[1]}
+            f.write(pixels)
+            offset += len(pixels)
+
+    replace_file(os.path.join(atlas_dir, data_name), write_data)
+    index = {'version': atlas_version, 'signature': signature, 'data': data_name, 'sources': sources, 'entries': entries}
+    replace_file(os.path.join(atlas_dir, atlas_index_name), lambda f: f.write(json.dumps(index, indent=1).encode()))
+    # Only finished atlases from older signatures go; temporary files may belong to a compile in progress
+    for filename in os.listdir(atlas_dir):
+        if filename.startswith('atlas-') and filename.endswith('.rgba') and filename != data_name:
+            try:
+                os.remove(os.path.join(atlas_dir, filename))
+            except OSError:
+                pass  # already removed by another compile, or still mapped on Windows
+    return True
+
+def replace_file(path, write):
+    # write(f) fills a temporary file unique to this process, which is then renamed over path
+    fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def load_deck_atlas(deck_path):
+    # relative asset path -> read-only RGBA image backed by the mapped atlas, or None when the deck
+    # has not been compiled or the atlas is stale
+    index = read_atlas_index(deck_path)
+    if not atlas_is_fresh(deck_path, index):
+        return None
+    with open(os.path.join(deck_path, atlas_dir_name, index['data']), 'rb') as f:
+        mapped = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    images = {}
+    for name, entry in index['entries'].items():
+        size = (entry['width'], entry['height'])
+        pixels = mapped[entry['offset']:entry['offset'] + size[0] * size[1] * 4]
+        images[name] = Image.frombuffer('RGBA', size, pixels, 'raw', 'RGBA', 0, 1)
+    return images
+
+def open_asset(atlas, deck_path, name):
+    if atlas is not None and name in atlas:
+        return atlas[name]
+    return Image.open(os.path.join(deck_path, 'assets', name)).convert("RGBA")
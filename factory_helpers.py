@@ -1,10 +1,27 @@
+import math
 import os
 import random
 import webbrowser
-from PIL import Image, ImageEnhance
-from multiprocessing import Pool
+from PIL import Image
+import json
+import shutil
+import tempfile
+import time
+from multiprocessing import Pool, util
 from tqdm import tqdm
 from models import yolov8, yolov5
+from backgrounds import BackgroundPool
+from deck_atlas import compile_deck_atlas, load_deck_atlas, open_asset
+from manifest import changed_parameters, load_manifest, record_run
+from grain import NoiseBank, grain_styles
+from layouts import Layout
+from compositing import PILBackend, render_backends
+from sprite_cache import SpriteCache, hit_rate, scale_modes, variant_nbytes
+from sprite_transforms import quantize_transform, quantized_transforms, random_transform, transform_modes
+from scheduler import TaskWindow, available_cpus, memory_ceiling, plan_pool, process_rss, total_rss
+from output_writer import DirectorySink, OutputWriter, encode_image, format_annotations, image_extension, image_formats, write_file
+from shards import TarShardSink, write_shard_index
+from telemetry import Telemetry, build_run_report, format_run_report, load_worker_snapshots, null_telemetry
 
 card_names = [
     '10C', '10D', '10H', '10S', '2C', '2D', '2H', '2S', '3C', '3D', '3H', '3S', '4C', '4D', '4H', '4S',
@@ -12,6 +29,14 @@ card_names = [
     '9C', '9D', '9H', '9S', 'AC', 'AD', 'AH', 'AS', 'JC', 'JD', 'JH', 'JS', 'KC', 'KD', 'KH', 'KS',
     'QC', 'QD', 'QH', 'QS'
 ]
+# Class index per card, looked up once per card in every image
+card_class_index = {card_name: i for i, card_name in enumerate(card_names)}
+player_seated_class_index = len(card_names)  # PlayerSeated is the next class index after cards
+player_active_class_index = len(card_names) + 1  # PlayerActive is the next class index after PlayerSeated
+dealer_button_class_index = len(card_names) + 2  # DealerButton is the next class index after PlayerActive
+
+# The original 1024x768 table: a row of cards and six seats
+default_layout = Layout()
 
 model_modules = {
     'yolov8': yolov8,
@@ -23,16 +48,236 @@ def load_card_images(deck_path):
     card_images_dir = os.path.join(deck_path, 'assets', 'cards')
     if not os.path.exists(card_images_dir):
         raise FileNotFoundError(f"Cards directory not found in {card_images_dir}")
-    for filename in os.listdir(card_images_dir):
+    atlas = load_deck_atlas(deck_path)
+    for filename in sorted(os.listdir(card_images_dir)):
         if filename.endswith('.png'):
             card_name = filename[:-4]
-            card_images[card_name] = Image.open(os.path.join(card_images_dir, filename)).convert("RGBA")
+            card_images[card_name] = open_asset(atlas, deck_path, f'cards/{filename}')
     return card_images
 
-def generate_single_sample(deck_path, deck_name, brightness_range, grain_range, size_variation, open_directory, include_active_players, include_seated_players, include_dealer_button, selected_model):
-    try:
+# Decoded deck assets, cached once per process. Pool workers warm these in init_worker so
+# tasks only carry a small (split, index) descriptor instead of pickled images.
+_card_images_cache = {}
+_player_images_cache = {}
+_worker_state = {}
+
+def get_card_images(deck_path):
+    card_images = _card_images_cache.get(deck_path)
+    if card_images is None:
         card_images = load_card_images(deck_path)
-    except FileNotFoundError as e:
+        _card_images_cache[deck_path] = card_images
+    return card_images
+
+def get_player_images(deck_path):
+    player_images = _player_images_cache.get(deck_path)
+    if player_images is None:
+        player_images = load_player_images(deck_path)
+        _player_images_cache[deck_path] = player_images
+    return player_images
+
+def deck_list(deck_path):
+    # Runs take one deck path or a list of them to mix into one dataset
+    return [deck_path] if isinstance(deck_path, str) else list(deck_path)
+
+def uses_player_images(options):
+    return options['include_seated_players'] or options['include_active_players'] or options['include_dealer_button']
+
+def check_render_options(options):
+    # Raises ValueError for a choice a worker would fail on. A Pool respawns an initializer that
+    # raises forever, so whatever init_render_state and init_worker depend on is checked in the parent.
+    choices = [('render_backend', list(render_backends)), ('grain_style', grain_styles),
+               ('sprite_scale_mode', scale_modes), ('transform_mode', transform_modes),
+               ('selected_model', list(model_modules)), ('image_format', list(image_formats))]
+    for name, allowed in choices:
+        if name in options and options[name] not in allowed:
+            raise ValueError(f"Unknown {name} '{options[name]}', expected one of {allowed}")
+    Layout(options['image_size'], options['layout'], options['seat_map'])
+
+def load_deck_assets(deck_path, options):
+    # Loads everything a run needs from one deck in this process, raising FileNotFoundError for a
+    # missing asset, and returns the deck's card names that have no class index
+    unknown = set(get_card_images(deck_path)) - set(card_names)
+    if uses_player_images(options):
+        get_player_images(deck_path)
+    return unknown
+
+def transform_variants(deck_paths, options):
+    # (count, bytes) of every quantized transform variant of the transformable assets, what the
+    # sprite cache's variant tier holds once warm. The dealer button is never transformed.
+    if options['transform_mode'] != 'quantized' or (options['rotation_range'] <= 0 and options['skew_range'] <= 0):
+        return 0, 0
+    sizes = []
+    for path in deck_paths:
+        sizes += [image.size for image in get_card_images(path).values()]
+        if uses_player_images(options):
+            seated_images, active_image, _ = get_player_images(path)
+            sizes += [image.size for image in seated_images] + [active_image.size]
+    transforms = quantized_transforms(options['rotation_range'], options['skew_range'], options['angle_step'],
+                                      options['skew_step'])
+    return len(sizes) * len(transforms), variant_nbytes(sizes, transforms)
+
+def variant_budget(deck_paths, options):
+    # Bytes the variant tier may hold: all variants, capped at variant_cache_mb
+    return min(transform_variants(deck_paths, options)[1], options['variant_cache_mb'] * 1024 * 1024)
+
+def seeded_background_pool(image_size, options):
+    # Seeded from the run seed so every worker holds the same pool
+    pool_rng = random.Random(f"{options['seed']}:background_pool")
+    return BackgroundPool(image_size, options['background_pool_size'], options['background_color_shift'], pool_rng)
+
+def init_render_state(deck_path, options, telemetry=null_telemetry):
+    # Everything one process needs to render images for a run: warm assets for every deck, the shared
+    # background pool and noise bank, a backend and a sprite cache. Dataset workers keep it in _worker_state.
+    state = {'deck_paths': deck_list(deck_path), 'options': options, 'telemetry': telemetry,
+             'layout': Layout(options['image_size'], options['layout'], options['seat_map'])}
+    image_size = state['layout'].image_size
+    with telemetry.stage('asset_load'):
+        for path in state['deck_paths']:
+            get_card_images(path)
+            if uses_player_images(options):
+                get_player_images(path)
+    if options['background_pool_size'] > 0:
+        state['background_pool'] = seeded_background_pool(image_size, options)
+    if options['grain_range'] > 0:
+        grain_rng = random.Random(f"{options['seed']}:grain_bank")
+        state['noise_bank'] = NoiseBank(image_size, options['grain_style'], options['grain_bank_size'], grain_rng)
+    state['backend'] = render_backends[options['render_backend']]()
+    state['sprite_cache'] = SpriteCache(options['sprite_cache_mb'] * 1024 * 1024, options['sprite_scale_mode'],
+                                        options['sprite_scale_buckets'], options['size_variation'],
+                                        state['layout'].scale, variant_budget(state['deck_paths'], options))
+    return state
+
+def init_worker(deck_path, options, cancel_event=None):
+    telemetry = Telemetry() if options['telemetry_dir'] else null_telemetry
+    _worker_state.update(init_render_state(deck_path, options, telemetry))
+    _worker_state['cancel_event'] = cancel_event
+    if options['output_mode'] == 'tar':
+        prefix = f"{options['shard'][0]:03d}-{os.getpid()}"
+        if options['run'] > 0:
+            prefix = f"{options['run']:02d}-{prefix}"  # extend runs must not reuse an earlier run's shard names
+        sink = TarShardSink(os.path.join(options['output_dir'], 'shards'), options['shard_size'], prefix)
+    else:
+        sink = DirectorySink(options['output_dir'], options['label_batch_size'])
+    writer = OutputWriter(sink, options['image_format'], options['compress_level'], options['quality'],
+                          options['writer_threads'], options['writer_queue_size'], telemetry)
+    _worker_state['writer'] = writer
+    # Pool workers run finalizers on a clean exit (pool.close + join), which drains the queue.
+    # Higher exit priorities run first, so telemetry is dumped after the last write.
+    util.Finalize(writer, writer.close, exitpriority=10)
+    if telemetry.enabled:
+        util.Finalize(telemetry, dump_worker_telemetry, args=(telemetry, options), exitpriority=5)
+
+def dump_worker_telemetry(telemetry, options):
+    telemetry.count('sprite_cache_hits', _worker_state['sprite_cache'].hits)
+    telemetry.count('sprite_cache_misses', _worker_state['sprite_cache'].misses)
+    telemetry.dump(options['telemetry_dir'])
+
+def image_rng(seed, split, index):
+    # Every image gets its own RNG derived from (seed, split, index), so output does not depend
+    # on which worker or shard renders it. String seeds are hashed with SHA-512, stable across runs.
+    return random.Random(f'{seed}:{split}:{index}')
+
+def is_valid_sample(image_path, label_path):
+    try:
+        with open(label_path) as f:
+            lines = f.read().splitlines()
+        if not lines or any(len([float(value) for value in line.split()]) != 5 for line in lines):
+            return False
+        with Image.open(image_path) as image:
+            image.verify()
+    except (OSError, ValueError, SyntaxError):
+        return False
+    return True
+
+def generate_dataset_image(task):
+    started = time.perf_counter()
+    split, index = task
+    options = _worker_state['options']
+    writer = _worker_state['writer']
+    key = f'{split}_{index}'
+    cancel_event = _worker_state['cancel_event']
+    if cancel_event is not None and cancel_event.is_set():
+        return os.getpid(), _worker_state['sprite_cache'].stats(), 'cancelled'
+    if options['resume'] and is_valid_sample(*writer.sink.paths(split, key, image_extension(options['image_format']))):
+        return os.getpid(), _worker_state['sprite_cache'].stats(), 'skipped'
+    combined_image, annotations = render_task_image(_worker_state, split, index)
+    writer.submit(combined_image, split, key, annotations, started)
+    return os.getpid(), _worker_state['sprite_cache'].stats(), 'generated'
+
+def render_task_image(state, split, index):
+    # The image and annotations for (split, index) of a run; the same for every process holding the state
+    options = state['options']
+    rng = image_rng(options['seed'], split, index)
+    deck_path = state['deck_paths'][0]
+    if len(state['deck_paths']) > 1:
+        # Only mixed runs spend a draw on the deck, so single deck output is unchanged
+        deck_path = rng.choices(state['deck_paths'], options['deck_weights'])[0]
+    return render_random_card_combination(
+        get_card_images(deck_path), None, 5, 40, 0.9,
+        options['brightness_range'], options['grain_range'], options['size_variation'], deck_path,
+        options['include_active_players'], options['include_seated_players'], options['include_dealer_button'],
+        options['selected_model'], background_pool=state.get('background_pool'),
+        noise_bank=state.get('noise_bank'), sprite_cache=state['sprite_cache'], rng=rng,
+        telemetry=state['telemetry'], backend=state['backend'], rotation_range=options['rotation_range'],
+        skew_range=options['skew_range'], transform_mode=options['transform_mode'], angle_step=options['angle_step'],
+        skew_step=options['skew_step'], layout=state['layout'])
+
+calibration_images = 4
+
+def init_calibration_worker(deck_path, options):
+    _worker_state.update(init_render_state(deck_path, options))
+
+def calibrate_worker(count):
+    # Renders and encodes count throwaway images like a dataset worker would and reports the cost.
+    # The first image pays for cache misses, so the time per image is taken from the rest.
+    options = _worker_state['options']
+    times = []
+    for index in range(count):
+        started = time.perf_counter()
+        image, _ = render_task_image(_worker_state, 'calibration', index)
+        encode_image(image, options['image_format'], options['compress_level'], options['quality'])
+        times.append(time.perf_counter() - started)
+    steady = times[1:] or times
+    return {'seconds_per_image': sum(steady) / len(steady), 'rss': process_rss(),
+            'sprite_cache_bytes': _worker_state['sprite_cache'].tier_bytes['sprites'],
+            'variant_cache_bytes': _worker_state['sprite_cache'].tier_bytes['variants'],
+            'variant_bytes': _worker_state['sprite_cache'].variant_bytes,
+            'queued_bytes': (options['writer_queue_size'] + options['writer_threads']) * image.width * image.height * 4}
+
+def calibrate(deck_path, options):
+    with Pool(1, initializer=init_calibration_worker, initargs=(deck_path, options)) as pool:
+        return pool.apply(calibrate_worker, (calibration_images,))
+
+def parse_shard(shard):
+    # 'k/N' -> (k, N), shards numbered from 0
+    try:
+        shard_index, shard_count = (int(part) for part in shard.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{shard}', expected k/N")
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard '{shard}', k must be in 0..N-1")
+    return shard_index, shard_count
+
+def shard_range(start, count, shard):
+    # Indices start..start+count-1 that belong to shard k of N: those with index % N == k, so a
+    # dataset extended in steps is split across shards exactly like one generated in one go
+    shard_index, shard_count = shard
+    return range(start + (shard_index - start) % shard_count, start + count, shard_count)
+
+def iter_tasks(split_counts, shard=(0, 1), cancel_event=None, split_starts=None):
+    # Task descriptors are produced lazily so the pool never holds the whole run in memory
+    split_starts = split_starts or {}
+    for split, count in split_counts.items():
+        for i in shard_range(split_starts.get(split, 0), count, shard):
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            yield split, i
+
+def generate_single_sample(deck_path, deck_name, brightness_range, grain_range, size_variation, open_directory, include_active_players, include_seated_players, include_dealer_button, selected_model, seed=None, render_backend='pil', grain_style='gaussian', rotation_range=0, skew_range=0, transform_mode='quantized', angle_step=2, skew_step=0.1, image_size=(1024, 768), layout='row', seat_map='six_max'):
+    try:
+        card_images = get_card_images(deck_path)
+        layout = Layout(image_size, layout, seat_map)
+    except (FileNotFoundError, ValueError) as e:
         print(f"Error: {e}")
         return
 
@@ -45,48 +290,308 @@ def generate_single_sample(deck_path, deck_name, brightness_range, grain_range,
         output_image_path, output_label_path, card_images, None, 5, 40, 0.9, brightness_range, grain_range, size_variation, deck_path, include_active_players, include_seated_players, include_dealer_button, selected_model
     )
 
-    generate_random_card_combination(*args)
+    rng = random.Random(seed) if seed is not None else random
+    noise_bank = NoiseBank(layout.image_size, grain_style, 1, random.Random(f"{seed}:grain_bank")) if grain_range > 0 else None
+    generate_random_card_combination(*args, rng=rng, noise_bank=noise_bank, backend=render_backends[render_backend](),
+                                     rotation_range=rotation_range, skew_range=skew_range, transform_mode=transform_mode,
+                                     angle_step=angle_step, skew_step=skew_step, layout=layout)
 
     if open_directory:
         webbrowser.open(output_dir)
+    return output_dir
+
+def prepare_deck_atlas(deck_path):
+    try:
+        # Compiled once so workers map the decoded deck instead of each decoding its own copy
+        compile_deck_atlas(deck_path)
+    except FileNotFoundError:
+        pass  # reported when the assets are loaded
+    except OSError as e:
+        print(f"Could not compile the deck atlas, decoding assets per worker instead: {e}")
 
 def generate_dataset(deck_path, deck_name, num_images, train_split, valid_split, test_split, brightness_range,
-                     grain_range, size_variation, open_directory, include_active_players, include_seated_players, include_dealer_button, selected_model):
+                     grain_range, size_variation, open_directory, include_active_players, include_seated_players, include_dealer_button, selected_model,
+                     background_pool_size=0, background_color_shift=0, sprite_cache_mb=64, variant_cache_mb=256,
+                     sprite_scale_mode='exact',
+                     sprite_scale_buckets=16, workers=None, chunksize=8, seed=None, shard=(0, 1), resume=False,
+                     image_format='png', compress_level=6, quality=95, writer_threads=2, writer_queue_size=8,
+                     label_batch_size=1, output_mode='files', shard_size=1000, output_dir=None, show_progress=True,
+                     telemetry=False, report_path=None, progress_callback=None, cancel_event=None,
+                     render_backend='pil', grain_style='gaussian', grain_bank_size=4, rotation_range=0, skew_range=0,
+                     transform_mode='quantized', angle_step=2, skew_step=0.1, extend=False, deck_weights=None,
+                     auto_tune=False, memory_limit_mb=None, image_size=(1024, 768), layout='row', seat_map='six_max'):
+    # progress_callback(done, total) is called from this thread after every image. cancel_event must be a
+    # multiprocessing.Event: once set, no new tasks are issued, queued tasks are dropped by the workers
+    # and the pool shuts down cleanly, leaving every finished image/label pair and data.yaml in place.
+    # extend adds num_images to the dataset in output_dir, continuing each split after its last index.
+    # deck_path may be a list of decks, mixed per image by deck_weights (equal weights by default).
+    # auto_tune picks workers and chunksize from a short calibration run. With a memory ceiling
+    # (memory_limit_mb, or 90% of the cgroup limit) calibration also caps workers to what fits.
+    # image_size renders at another resolution; layout and seat_map pick templates from layouts.py.
+    if resume and output_mode == 'tar':
+        print("Error: resume is only supported for file output")
+        return
+
+    # A plain run starts a new manifest unless it resumes or extends the dataset it describes
+    manifest = load_manifest(output_dir) if extend else None
+    if extend and manifest is None:
+        print(f"Error: no manifest.json in {output_dir}, only datasets generated with a manifest can be extended")
+        return
+    if extend and 'pending' in manifest:
+        pending = manifest['pending']
+        print(f"Error: the last run on {output_dir} was cancelled. Finish it before extending with: "
+              f"imagefactory generate --resume --output-dir {output_dir} --num-images {pending['num_images']} "
+              f"and the options the dataset was made with")
+        return
+
     try:
-        card_images = load_card_images(deck_path)
-    except FileNotFoundError as e:
+        check_render_options({'render_backend': render_backend, 'grain_style': grain_style,
+                              'sprite_scale_mode': sprite_scale_mode, 'transform_mode': transform_mode,
+                              'selected_model': selected_model, 'image_format': image_format,
+                              'image_size': image_size, 'layout': layout, 'seat_map': seat_map})
+    except ValueError as e:
         print(f"Error: {e}")
         return
 
-    output_dir = os.path.join(deck_path, f'generated_datasets/ImageFactory_{deck_name}_{selected_model}_{num_images}')
-    dirs = ['train/images', 'train/labels', 'valid/images', 'valid/labels', 'test/images', 'test/labels']
+    deck_paths = deck_list(deck_path)
+    if deck_weights is not None and (len(deck_weights) != len(deck_paths) or min(deck_weights) < 0 or not sum(deck_weights)):
+        print(f"Error: expected {len(deck_paths)} non-negative deck weights, got {deck_weights}")
+        return
+    for path in deck_paths:
+        prepare_deck_atlas(path)
+        try:
+            # Loaded in the parent so a bad deck fails fast instead of in every worker initializer;
+            # forked workers inherit the warm cache
+            unknown = load_deck_assets(path, {'include_seated_players': include_seated_players,
+                                              'include_active_players': include_active_players,
+                                              'include_dealer_button': include_dealer_button})
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            return
+        if unknown:
+            # Every deck shares the card_names class map, so a card outside it has no class index
+            print(f"Error: {path} has cards outside the class map: {', '.join(sorted(unknown))}")
+            return
+
+    if output_dir is None:
+        output_dir = os.path.join(deck_paths[0], f'generated_datasets/ImageFactory_{deck_name}_{selected_model}_{num_images}')
+    if output_mode == 'tar':
+        dirs = ['shards']
+    else:
+        dirs = ['train/images', 'train/labels', 'valid/images', 'valid/labels', 'test/images', 'test/labels']
     for dir in dirs:
         os.makedirs(os.path.join(output_dir, dir), exist_ok=True)
+    if resume:
+        manifest = load_manifest(output_dir)
 
     splits = {'train': train_split, 'valid': valid_split, 'test': test_split}
     split_counts = {k: int(v * num_images) for k, v in splits.items()}
-
-    args_list = []
-    for split, count in split_counts.items():
-        for i in range(count):
-            output_image_path = os.path.join(output_dir, f'{split}/images/{split}_{i}.png')
-            output_label_path = os.path.join(output_dir, f'{split}/labels/{split}_{i}.txt')
-            args = (output_image_path, output_label_path, card_images, None, 5, 40, 0.9, brightness_range, grain_range,
-                    size_variation, deck_path, include_active_players, include_seated_players, include_dealer_button, selected_model)
-            args_list.append(args)
-
-    with Pool() as pool:
-        for _ in tqdm(pool.imap_unordered(generate_random_card_combination_wrapper, args_list), total=len(args_list)):
-            pass
+    split_starts = {}
+    dataset_images = num_images
+    if extend:
+        # Split sizes are worked out for the new total, so extending 50k to 200k with the same seed gives
+        # exactly the images a 200k run would have
+        split_starts = dict(manifest['counts'])
+        dataset_images = manifest['num_images'] + num_images
+        split_counts = {k: max(0, int(v * dataset_images) - split_starts.get(k, 0)) for k, v in splits.items()}
+        if seed is None:
+            seed = manifest['seed']
+    elif resume and manifest is not None:
+        # Gaps must be filled with the images the interrupted run would have written
+        run_seed = manifest.get('pending', {}).get('seed', manifest['seed'])
+        if seed is None:
+            seed = run_seed
+            print(f"Resuming with seed {seed}")
+        elif seed != run_seed:
+            print(f"Error: the run on {output_dir} used seed {run_seed}, resuming with seed {seed} would fill "
+                  f"its gaps with different images; drop --seed or pass --seed {run_seed}")
+            return
+
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+        print(f"Using seed {seed}")
+
+    options = {
+        'output_dir': output_dir,
+        'brightness_range': brightness_range,
+        'grain_range': grain_range,
+        'grain_style': grain_style,
+        'grain_bank_size': grain_bank_size,
+        'size_variation': size_variation,
+        'rotation_range': rotation_range,
+        'skew_range': skew_range,
+        'transform_mode': transform_mode,
+        'angle_step': angle_step,
+        'skew_step': skew_step,
+        'include_active_players': include_active_players,
+        'include_seated_players': include_seated_players,
+        'include_dealer_button': include_dealer_button,
+        'selected_model': selected_model,
+        'background_pool_size': background_pool_size,
+        'background_color_shift': background_color_shift,
+        'sprite_cache_mb': sprite_cache_mb,
+        'variant_cache_mb': variant_cache_mb,
+        'sprite_scale_mode': sprite_scale_mode,
+        'sprite_scale_buckets': sprite_scale_buckets,
+        'seed': seed,
+        'resume': resume,
+        'image_format': image_format,
+        'compress_level': compress_level,
+        'quality': quality,
+        'writer_threads': writer_threads,
+        'writer_queue_size': writer_queue_size,
+        'label_batch_size': label_batch_size,
+        'output_mode': output_mode,
+        'shard_size': shard_size,
+        'shard': shard,
+        'render_backend': render_backend,
+        'deck_weights': deck_weights,
+        'image_size': list(image_size),
+        'layout': layout,
+        'seat_map': seat_map,
+        'run': len(manifest['runs']) if manifest else 0,
+    }
+    if resume and manifest is not None:
+        changed = changed_parameters(manifest, options)
+        if changed:
+            print(f"Error: {output_dir} was generated with different {', '.join(changed)}; "
+                  f"resume with the options it was made with")
+            return
+    options['telemetry_dir'] = tempfile.mkdtemp(prefix='imagefactory_telemetry_') if telemetry else None
+    total_images = sum(len(shard_range(split_starts.get(split, 0), count, shard))
+                       for split, count in split_counts.items())
+
+    variant_count, variant_bytes = transform_variants(deck_paths, options)
+    variant_cache_mb = min(variant_cache_mb, math.ceil(variant_bytes / 2 ** 20))
+    if variant_cache_mb > 0:
+        print(f"Transformed sprites: {variant_count} variants, {variant_bytes // 2 ** 20} MB in all, "
+              f"up to {variant_cache_mb} MB per worker cached on top of the sprite cache")
+
+    cpus = available_cpus()
+    ceiling = memory_ceiling(memory_limit_mb)
+    if (auto_tune or ceiling is not None) and total_images > 0:
+        calibration = calibrate(deck_path, options)
+        plan = plan_pool(total_images, calibration, cpus, ceiling, workers if auto_tune else workers or cpus,
+                         sprite_cache_mb, variant_cache_mb)
+        workers = plan['workers']
+        if auto_tune:
+            chunksize = plan['chunksize']
+        if plan['sprite_cache_mb'] < sprite_cache_mb:
+            print(f"Sprite cache reduced to {plan['sprite_cache_mb']} MB per worker to stay under the memory ceiling")
+            options['sprite_cache_mb'] = plan['sprite_cache_mb']
+        if plan['variant_cache_mb'] < variant_cache_mb:
+            print(f"Transformed sprite cache reduced to {plan['variant_cache_mb']} MB per worker to stay under the "
+                  f"memory ceiling")
+            options['variant_cache_mb'] = plan['variant_cache_mb']
+        summary = f"{workers} workers, chunksize {chunksize}, {calibration['seconds_per_image'] * 1000:.0f} ms/image"
+        if plan['per_worker'] is not None:
+            summary += f", ~{plan['per_worker'] // 2 ** 20} MB per worker"
+        if ceiling is not None:
+            summary += f", memory ceiling {ceiling // 2 ** 20} MB"
+        print(f"Scheduler: {summary}")
+    workers = workers or cpus
+    chunksize = max(1, chunksize)
+
+    worker_cache_stats = {}
+    peak_rss = 0
+    last_rss_check = 0
+    status_counts = {'generated': 0, 'skipped': 0, 'cancelled': 0}
+    started = time.perf_counter()
+    with Pool(workers, initializer=init_worker, initargs=(deck_path, options, cancel_event)) as pool:
+        # Two chunks in flight per worker: one running, one queued. Workers blocked on a full writer
+        # queue stop returning results, which stops new tasks being queued.
+        tasks = TaskWindow(iter_tasks(split_counts, shard, cancel_event, split_starts), 2 * workers * chunksize)
+        results = pool.imap_unordered(generate_dataset_image, tasks, chunksize=chunksize)
+        try:
+            for pid, cache_stats, status in tqdm(results, total=total_images, disable=not show_progress):
+                tasks.release()
+                worker_cache_stats[pid] = cache_stats
+                status_counts[status] += 1
+                if progress_callback is not None:
+                    progress_callback(status_counts['generated'] + status_counts['skipped'], total_images)
+                if ceiling is not None and time.perf_counter() - last_rss_check > 1:
+                    last_rss_check = time.perf_counter()
+                    rss = total_rss(worker_cache_stats)
+                    if rss > ceiling and peak_rss <= ceiling:
+                        print(f"Warning: run is using {rss // 2 ** 20} MB, above the {ceiling // 2 ** 20} MB memory ceiling")
+                    peak_rss = max(peak_rss, rss)
+        finally:
+            tasks.close()
+        # close + join instead of terminate so every worker drains its output queue
+        pool.close()
+        pool.join()
+
+    wall_seconds = time.perf_counter() - started
+    skipped = status_counts['skipped']
+    cancelled = cancel_event is not None and cancel_event.is_set()
+
+    if output_mode == 'tar':
+        write_shard_index(os.path.join(output_dir, 'shards'))
+
+    if telemetry:
+        snapshots = load_worker_snapshots(options['telemetry_dir'])
+        shutil.rmtree(options['telemetry_dir'], ignore_errors=True)
+        report = build_run_report(snapshots, wall_seconds, {'skipped': skipped, 'image_format': image_format,
+                                                            'output_mode': output_mode})
+        report_path = report_path or os.path.join(output_dir, 'run_report.json')
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(format_run_report(report))
+        print(f"Run report written to {report_path}")
+
+    if resume:
+        print(f"Resumed: {skipped} existing images kept, {status_counts['generated']} generated")
+
+    if cancelled:
+        print(f"Cancelled: {status_counts['generated'] + skipped} of {total_images} images written, "
+              f"rerun with --resume --seed {seed} to finish")
+
+    if worker_cache_stats and sprite_cache_mb > 0:
+        total_stats = {key: sum(stats[key] for stats in worker_cache_stats.values()) for key in ('hits', 'misses', 'evictions')}
+        print(f"Sprite cache ({sprite_scale_mode}): {hit_rate(total_stats):.1%} hit rate, "
+              f"{total_stats['hits']} hits, {total_stats['misses']} misses, {total_stats['evictions']} evictions")
+
+    record_run(manifest, output_dir, deck_path, deck_name, dataset_images, splits, split_counts, split_starts, options,
+               status_counts, cancelled)
 
     model_module = model_modules[selected_model]
-    model_module.save_annotations_and_metadata(output_dir, card_names, include_dealer_button, include_active_players, include_seated_players, deck_name, selected_model, num_images)
+    model_module.save_annotations_and_metadata(output_dir, card_names, deck_name, selected_model, dataset_images, image_format)
 
     if open_directory:
         webbrowser.open(output_dir)
 
-def generate_random_card_combination_wrapper(args):
-    generate_random_card_combination(*args)
+    return {'output_dir': output_dir, 'seed': seed, 'total': total_images, 'generated': status_counts['generated'],
+            'skipped': skipped, 'cancelled': cancelled}
+
+def extend_dataset(dataset_dir, num_images, seed=None, workers=None, chunksize=8, show_progress=True, telemetry=False,
+                   progress_callback=None, cancel_event=None, auto_tune=False, memory_limit_mb=None):
+    # Renders num_images more into an existing dataset with the parameters it was made with. Existing
+    # images are never touched; with the original seed the result matches generating the total at once.
+    manifest = load_manifest(dataset_dir)
+    if manifest is None:
+        print(f"Error: no manifest.json in {dataset_dir}, only datasets generated with a manifest can be extended")
+        return
+    splits = manifest['splits']
+    result = generate_dataset(manifest['deck_path'], manifest['deck_name'], num_images, splits['train'], splits['valid'],
+                              splits['test'], open_directory=False, workers=workers, chunksize=chunksize, seed=seed,
+                              output_dir=dataset_dir, show_progress=show_progress, telemetry=telemetry,
+                              progress_callback=progress_callback, cancel_event=cancel_event, extend=True,
+                              auto_tune=auto_tune, memory_limit_mb=memory_limit_mb,
+                              **manifest['parameters'])
+    if result is None:
+        return
+
+    # Datasets in the default location are named after their size; follow the new size if nothing is in the way
+    parent, name = os.path.split(os.path.normpath(dataset_dir))
+    previous_name = f"ImageFactory_{manifest['deck_name']}_{manifest['parameters']['selected_model']}_{manifest['num_images']}"
+    if name == previous_name:
+        total = load_manifest(dataset_dir)['num_images']
+        renamed = os.path.join(parent, previous_name.rsplit('_', 1)[0] + f'_{total}')
+        if not os.path.exists(renamed):
+            os.rename(dataset_dir, renamed)
+            print(f"Dataset moved to {renamed}")
+            result['output_dir'] = renamed
+    return result
 
 def create_new_deck(deck_name):
     deck_path = os.path.join('deck', deck_name)
@@ -111,164 +616,120 @@ def load_player_images(deck_path):
     dealer_path = os.path.join(deck_path, 'assets', 'table', 'DealerButton.png')
 
     if not os.path.exists(seated_dir) or not os.path.exists(active_path) or not os.path.exists(dealer_path):
-        raise FileNotFoundError("One of the required directories or files for players is missing.")
+        raise FileNotFoundError(f"One of the required directories or files for players is missing in {deck_path}. "
+                                "Turn off seated players, active players and the dealer button for a deck without them.")
 
-    for filename in os.listdir(seated_dir):
+    atlas = load_deck_atlas(deck_path)
+    for filename in sorted(os.listdir(seated_dir)):
         if filename.endswith('.png'):
-            seated_images.append(Image.open(os.path.join(seated_dir, filename)).convert("RGBA"))
+            seated_images.append(open_asset(atlas, deck_path, f'players/seated/{filename}'))
 
-    active_image = Image.open(active_path).convert("RGBA")
-    dealer_button = Image.open(dealer_path).convert("RGBA")
+    active_image = open_asset(atlas, deck_path, 'players/active/PlayerActive.png')
+    dealer_button = open_asset(atlas, deck_path, 'table/DealerButton.png')
 
     return seated_images, active_image, dealer_button
 
-def generate_random_gradient(image_size):
-    def random_color_within_range(base_color, variation):
-        return tuple(
-            max(0, min(255, base_color[i] + random.randint(-variation, variation))) for i in range(3)
-        )
-
-    base_color = tuple(random.randint(50, 100) for _ in range(3))  # base darker color
-    variation = 25  # variation range to keep colors close
-
-    start_color = random_color_within_range(base_color, variation)
-    end_color = random_color_within_range(base_color, variation)
-
-    base = Image.new('RGBA', image_size, start_color)
-    top = Image.new('RGBA', image_size, end_color)
-    mask = Image.new('L', image_size)
-    mask_data = []
-
-    for y in range(image_size[1]):
-        mask_data.extend([int(255 * (y / image_size[1]))] * image_size[0])
-    mask.putdata(mask_data)
-    base.paste(top, (0, 0), mask)
-    return base
-
-def generate_random_card_combination(output_image_path, output_label_path, card_images, _, num_cards, space_between, resize_proportion, brightness_range, grain_range, size_variation, deck_path, include_active_players, include_seated_players, include_dealer_button, selected_model):
-    image_size = (1024, 768)  # Set your desired image size
-    combined_image = generate_random_gradient(image_size)
-
-    selected_cards = random.sample(list(card_images.keys()), num_cards)
+def generate_random_card_combination(output_image_path, output_label_path, *args, image_format='png', compress_level=6, quality=95, **kwargs):
+    combined_image, annotations = render_random_card_combination(*args, **kwargs)
+    write_file(output_image_path, encode_image(combined_image, image_format, compress_level, quality))
+    write_file(output_label_path, format_annotations(annotations))
+
+def render_random_card_combination(card_images, _, num_cards, space_between, resize_proportion, brightness_range, grain_range, size_variation, deck_path, include_active_players, include_seated_players, include_dealer_button, selected_model, background_pool=None, sprite_cache=None, rng=random, telemetry=null_telemetry, backend=None, noise_bank=None, rotation_range=0, skew_range=0, transform_mode='quantized', angle_step=2, skew_step=0.1, layout=None):
+    if layout is None:
+        layout = default_layout
+    image_size = layout.image_size
+    if backend is None:
+        backend = PILBackend()
+    with telemetry.stage('background'):
+        backend.begin(image_size, rng, background_pool)
+
+    # Templates with several variants (board sizes) draw one first; the default row draws nothing
+    card_plan = layout.sample_cards(rng, num_cards)
+    card_angles = [angle for _, _, angles in card_plan for angle in angles]
+    selected_cards = rng.sample(list(card_images.keys()), len(card_angles))
     annotations = []
 
-    def apply_filters(image, brightness_range, size_variation):
-        actual_resize_proportion = random.uniform(1 - size_variation, 1 + size_variation)
-        new_width = int(image.width * actual_resize_proportion)
-        new_height = int(image.height * actual_resize_proportion)
-        image = image.resize((new_width, new_height), Image.LANCZOS)
-
-        if brightness_range > 0:
-            enhancer = ImageEnhance.Brightness(image)
-            brightness_factor = random.uniform(1 - brightness_range, 1 + brightness_range)
-            image = enhancer.enhance(brightness_factor)
+    def apply_filters(image, brightness_range, size_variation, asset_key, transformable=True, base_angle=0):
+        with telemetry.stage('filter'):
+            # Scaled with the canvas; the product is exact at the reference size
+            actual_resize_proportion = rng.uniform(1 - size_variation, 1 + size_variation) * layout.scale
+            transform = None
+            cache = sprite_cache
+            if transformable and (rotation_range > 0 or skew_range > 0):
+                transform = random_transform(rng, rotation_range, skew_range)
+                if base_angle:
+                    transform = (transform[0] + base_angle,) + transform[1:]
+                if transform_mode == 'quantized':
+                    transform = quantize_transform(*transform, angle_step, skew_step)
+                else:
+                    cache = None  # exact transforms practically never repeat
+            elif transformable and base_angle:
+                transform = (base_angle, 0, 0)  # a fixed template tilt, cached like any other variant
+            image = backend.resize((deck_path, asset_key), image, actual_resize_proportion, cache, transform)
+
+            if brightness_range > 0:
+                brightness_factor = rng.uniform(1 - brightness_range, 1 + brightness_range)
+                image = backend.brighten(image, brightness_factor)
 
         return image
 
-    space_between += 10  # Increase spacing between cards
-
-    for i, card_name in enumerate(selected_cards):
-        card_image = card_images[card_name].copy()
-        card_image = apply_filters(card_image, brightness_range, size_variation)
-
-        card_width, card_height = card_image.size
-        x_position = (image_size[0] - num_cards * (card_width + space_between)) // 2 + i * (card_width + space_between)
-        y_position = (image_size[1] - card_height) // 2
-        combined_image.paste(card_image, (x_position, y_position), card_image)
+    def composite(sprite, position):
+        with telemetry.stage('composite'):
+            backend.composite(sprite, position)
 
-        center_x = (x_position + card_width / 2) / image_size[0]
-        center_y = (y_position + card_height / 2) / image_size[1]
-        width = card_width / image_size[0]
-        height = card_height / image_size[1]
-        class_index = card_names.index(card_name)
-        annotations.append(f"{class_index} {center_x} {center_y} {width} {height}")
+    def annotate(class_index, center_x, center_y, sprite):
+        annotations.append((class_index, center_x / image_size[0], center_y / image_size[1],
+                            sprite.width / image_size[0], sprite.height / image_size[1]))
 
-    seated_images, active_image, dealer_button = load_player_images(deck_path)
+    card_sprites = [apply_filters(card_images[card_name], brightness_range, size_variation, card_name, base_angle=angle)
+                    for card_name, angle in zip(selected_cards, card_angles)]
+    card_positions = layout.place_cards(card_plan, [sprite.size for sprite in card_sprites])
+    for card_name, card_image, (x_position, y_position) in zip(selected_cards, card_sprites, card_positions):
+        composite(card_image, (x_position, y_position))
+        annotate(card_class_index[card_name], x_position + card_image.width / 2, y_position + card_image.height / 2,
+                 card_image)
 
-    player_seated_class_index = len(card_names)  # Assuming PlayerSeated is the next class index after cards
-    player_active_class_index = len(card_names) + 1  # Assuming PlayerActive is the next class index after PlayerSeated
-    dealer_button_class_index = len(card_names) + 2  # Assuming DealerButton is the next class index after PlayerActive
+    if include_seated_players or include_active_players or include_dealer_button:
+        seated_images, active_image, dealer_button = get_player_images(deck_path)
 
+    seated_positions = []
     if include_seated_players:
-        num_seated = random.randint(2, 6)
-        slots = [
-            ("top_left", (image_size[0] // 8, 180)),
-            ("top_middle", (image_size[0] // 2, 150)),
-            ("top_right", (7 * image_size[0] // 8, 180)),
-            ("bottom_left", (image_size[0] // 8, image_size[1] - 180)),
-            ("bottom_middle", (image_size[0] // 2, image_size[1] - 100)),
-            ("bottom_right", (7 * image_size[0] // 8, image_size[1] - 180))
-        ]
-
-        random.shuffle(slots)
-        selected_slots = slots[:num_seated]
-
-        seated_positions = []
-        for slot, (seat_x, seat_y) in selected_slots:
-            seated_image = seated_images[selected_slots.index((slot, (seat_x, seat_y))) % len(seated_images)]
-            seated_image = apply_filters(seated_image, brightness_range, size_variation)
-
-            combined_image.paste(seated_image, (seat_x - seated_image.width // 2, seat_y - seated_image.height // 2), seated_image)
-
-            center_x = (seat_x) / image_size[0]
-            center_y = (seat_y) / image_size[1]
-            width = seated_image.width / image_size[0]
-            height = seated_image.height / image_size[1]
-            annotations.append(f"{player_seated_class_index} {center_x} {center_y} {width} {height}")
-
-            seated_positions.append((seat_x, seat_y, seated_image.width, seated_image.height, slot))
+        num_seated = rng.randint(2, len(layout.seats))
+        slots = list(layout.seats)
+        rng.shuffle(slots)
+
+        for seated_index, (slot, (seat_x, seat_y), side) in enumerate(slots[:num_seated]):
+            seated_index %= len(seated_images)
+            seated_image = apply_filters(seated_images[seated_index], brightness_range, size_variation, f'seated{seated_index}')
+            composite(seated_image, (seat_x - seated_image.width // 2, seat_y - seated_image.height // 2))
+            annotate(player_seated_class_index, seat_x, seat_y, seated_image)
+            seated_positions.append((seat_x, seat_y, seated_image.width, seated_image.height, side))
 
     if include_active_players:
-        for (seat_x, seat_y, seat_width, seat_height, slot) in seated_positions:
-            if random.choice([True, False]):
-                active_x = seat_x - active_image.width // 2
-                active_y = seat_y - active_image.height - seat_height // 2 - 20
-                active_image_filtered = apply_filters(active_image.copy(), brightness_range, size_variation)
-                combined_image.paste(active_image_filtered, (active_x, active_y), active_image_filtered)
-
-                center_x = (active_x + active_image_filtered.width / 2) / image_size[0]
-                center_y = (active_y + active_image_filtered.height / 2) / image_size[1]
-                width = active_image_filtered.width / image_size[0]
-                height = active_image_filtered.height / image_size[1]
-                annotations.append(f"{player_active_class_index} {center_x} {center_y} {width} {height}")
+        for (seat_x, seat_y, seat_width, seat_height, side) in seated_positions:
+            if rng.choice([True, False]):
+                active_x = seat_x - layout.scaled(active_image.width) // 2
+                active_y = seat_y - layout.scaled(active_image.height) - seat_height // 2 - layout.gap
+                active_image_filtered = apply_filters(active_image, brightness_range, size_variation, 'active')
+                composite(active_image_filtered, (active_x, active_y))
+                annotate(player_active_class_index, active_x + active_image_filtered.width / 2,
+                         active_y + active_image_filtered.height / 2, active_image_filtered)
 
     if include_dealer_button:
-        dealer_position = random.choice(seated_positions)
-        seat_x, seat_y, seat_width, seat_height, slot = dealer_position
-        offset = 20
-
-        if slot == "top_left":
-            dealer_x = seat_x + seat_width // 2 + offset
-            dealer_y = seat_y + seat_height // 2 + offset
-        elif slot == "top_middle":
-            dealer_x = seat_x
-            dealer_y = seat_y + seat_height // 2 + offset
-        elif slot == "top_right":
-            dealer_x = seat_x - seat_width // 2 - offset
-            dealer_y = seat_y + seat_height // 2 + offset
-        elif slot == "bottom_left":
-            dealer_x = seat_x + seat_width // 2 + offset
-            dealer_y = seat_y - seat_height // 2 - offset
-        elif slot == "bottom_middle":
-            dealer_x = seat_x + seat_width // 2 + offset
-            dealer_y = seat_y - seat_height // 2 - offset
-        else:  # bottom_right
-            dealer_x = seat_x - seat_width // 2 - offset
-            dealer_y = seat_y - seat_height // 2 - offset
-
-        dealer_button_filtered = apply_filters(dealer_button.copy(), brightness_range, size_variation)
-        combined_image.paste(dealer_button_filtered, (dealer_x - dealer_button_filtered.width // 2, dealer_y - dealer_button_filtered.height // 2), dealer_button_filtered)
-
-        center_x = (dealer_x) / image_size[0]
-        center_y = (dealer_y) / image_size[1]
-        width = dealer_button_filtered.width / image_size[0]
-        height = dealer_button_filtered.height / image_size[1]
-        annotations.append(f"{dealer_button_class_index} {center_x} {center_y} {width} {height}")
-
-    combined_image.save(output_image_path, format='PNG')
-
-    with open(output_label_path, 'w') as f:
-        f.write("\n".join(annotations))
+        seat_x, seat_y, seat_width, seat_height, side = rng.choice(seated_positions)
+        dealer_x, dealer_y = layout.dealer_position((seat_x, seat_y), side, (seat_width, seat_height))
+
+        # The button is round, so it is never rotated or skewed
+        dealer_button_filtered = apply_filters(dealer_button, brightness_range, size_variation, 'dealer', False)
+        composite(dealer_button_filtered, (dealer_x - dealer_button_filtered.width // 2, dealer_y - dealer_button_filtered.height // 2))
+        annotate(dealer_button_class_index, dealer_x, dealer_y, dealer_button_filtered)
+
+    # Last, so grain never changes the RNG draws behind the layout and labels
+    if grain_range > 0 and noise_bank is not None:
+        with telemetry.stage('grain'):
+            backend.add_grain(noise_bank, rng, grain_range)
+
+    return backend.finish(), annotations
 
 def find_decks():
     decks_dir = os.path.join(os.getcwd(), 'deck')
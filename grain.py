@@ -0,0 +1,84 @@
+import io
+import random
+import numpy as np
+from PIL import Image
+
+# Grain is added from a small bank of pre-generated noise textures instead of fresh per-pixel noise:
+# each image takes a window of a random texture at a random offset, scaled by a random intensity up
+# to grain_range. Textures are signed int8 RGBX with an empty fourth channel, so they line up with
+# both backends' canvases without touching alpha.
+grain_styles = ['gaussian', 'film', 'jpeg']
+
+noise_sigma = 32  # standard deviation in levels at full intensity (grain_range 1.0)
+texture_padding = 64  # room for random offsets around the image
+
+def normalize_noise(noise):
+    noise = noise * (noise_sigma / max(float(noise.std()), 1e-6))
+    return np.clip(np.rint(noise), -127, 127).astype(np.int8)
+
+def gaussian_noise(shape, generator):
+    # Independent noise per channel, like sensor noise
+    return normalize_noise(generator.standard_normal(shape + (3,), np.float32))
+
+def resample_noise(noise, size):
+    return np.asarray(Image.fromarray(noise, 'F').resize(size, Image.BICUBIC))
+
+def film_noise(shape, generator):
+    # Monochrome grain that clumps: noise at half resolution upscaled, plus a little fine noise
+    height, width = shape
+    coarse = resample_noise(generator.standard_normal((height // 2, width // 2), np.float32), (width, height))
+    fine = generator.standard_normal(shape, np.float32)
+    luminance = normalize_noise(coarse / coarse.std() * 0.8 + fine * 0.2)
+    return np.repeat(luminance[..., None], 3, axis=2)
+
+def jpeg_noise(shape, generator, quality=15):
+    # Blocking and mosquito noise: a smooth color field with fine detail is JPEG compressed at low
+    # quality, and the texture is what the decoder made of the detail, 8x8 blocks and all
+    height, width = shape
+    field = np.stack([resample_noise(generator.uniform(0, 255, (height // 32 + 1, width // 32 + 1)).astype(np.float32),
+                                     (width, height)) for _ in range(3)], axis=2)
+    detail = generator.standard_normal(shape + (3,), np.float32) * 12
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(field + detail, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=quality)
+    decoded = np.asarray(Image.open(buffer).convert('RGB'), dtype=np.float32)
+    return normalize_noise(decoded - field)
+
+noise_generators = {
+    'gaussian': gaussian_noise,
+    'film': film_noise,
+    'jpeg': jpeg_noise,
+}
+
+class NoiseBank:
+    def __init__(self, image_size, style='gaussian', bank_size=4, rng=random):
+        width, height = image_size
+        self.image_size = image_size
+        self.style = style
+        # JPEG artifacts sit on the 8x8 block grid, so their offsets keep to it
+        self.offset_step = 8 if style == 'jpeg' else 1
+        generator = np.random.default_rng(rng.getrandbits(64))
+        self.textures = []
+        for _ in range(max(1, bank_size)):
+            noise = noise_generators[style]((height + texture_padding, width + texture_padding), generator)
+            texture = np.zeros(noise.shape[:2] + (4,), np.int8)
+            texture[..., :3] = noise
+            self.textures.append(texture)
+        self.scratch = np.empty((height, width, 4), np.int16)
+
+    def apply(self, pixels, rng, grain_range):
+        # Adds grain in place to an HxWx4 uint8 array. Intensity is in 1/128 steps so the blend stays in int16.
+        level = round(rng.uniform(0, grain_range) * 128)
+        texture = self.textures[rng.randrange(len(self.textures))]
+        x = rng.randrange(0, texture_padding, self.offset_step)
+        y = rng.randrange(0, texture_padding, self.offset_step)
+        if level <= 0:
+            return
+        height, width = pixels.shape[:2]
+        scratch = self.scratch
+        scratch[...] = texture[y:y + height, x:x + width]
+        np.multiply(scratch, min(level, 256), out=scratch)
+        np.add(scratch, 64, out=scratch)
+        np.right_shift(scratch, 7, out=scratch)
+        np.add(scratch, pixels, out=scratch)
+        np.clip(scratch, 0, 255, out=scratch)
+        np.copyto(pixels, scratch, casting='unsafe')
@@ -0,0 +1,259 @@
+import argparse
+import os
+import sys
+
+from factory_helpers import generate_dataset, extend_dataset, generate_single_sample, create_new_deck, model_modules, parse_shard
+from sprite_cache import scale_modes
+from output_writer import image_formats
+from compositing import render_backends
+from grain import grain_styles
+from sprite_transforms import transform_modes
+from shards import expand_shards
+from deck_atlas import compile_deck_atlas
+from validate import format_report, validate_dataset, write_report
+from layouts import card_layouts, parse_image_size, seat_maps
+
+def resolve_deck(deck):
+    # Accept either a deck name under ./deck or a path to a deck directory
+    if os.path.isdir(deck):
+        deck_path = os.path.abspath(deck)
+    else:
+        deck_path = os.path.join(os.getcwd(), 'deck', deck)
+    return deck_path, os.path.basename(os.path.normpath(deck_path))
+
+def shard_argument(value):
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def image_size_argument(value):
+    try:
+        return parse_image_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def resolve_decks(decks):
+    # Several --deck options mix decks into one dataset named after all of them
+    resolved = [resolve_deck(deck) for deck in decks]
+    if len(resolved) == 1:
+        return resolved[0]
+    return [deck_path for deck_path, _ in resolved], '+'.join(deck_name for _, deck_name in resolved)
+
+def add_render_arguments(parser, multiple_decks=False):
+    if multiple_decks:
+        parser.add_argument('--deck', required=True, action='append',
+                            help="Deck name under ./deck or path to a deck directory; repeat to mix several decks")
+        parser.add_argument('--deck-weights', type=float, nargs='+', default=None,
+                            help="Relative share of images per --deck, in the same order (default: equal)")
+    else:
+        parser.add_argument('--deck', required=True, help="Deck name under ./deck or path to a deck directory")
+    parser.add_argument('--model', choices=list(model_modules), default='yolov8', help="Model format for data.yaml")
+    parser.add_argument('--brightness', type=float, default=40, help="Brightness variation (0-100%%)")
+    parser.add_argument('--grain', type=float, default=0, help="Grain variation (0-100%%)")
+    parser.add_argument('--grain-style', choices=grain_styles, default='gaussian',
+                        help="Grain texture: gaussian sensor noise, monochrome film grain or JPEG artifacts")
+    parser.add_argument('--size-variation', type=float, default=25, help="Size variation (0-100%%)")
+    parser.add_argument('--rotation', type=float, default=0, help="Max rotation of cards and players in degrees")
+    parser.add_argument('--skew', type=float, default=0, help="Max perspective skew of cards and players (0-100%%)")
+    parser.add_argument('--transform-mode', choices=transform_modes, default='quantized',
+                        help="quantized snaps rotation/skew to steps and caches the variants, exact transforms every sprite")
+    parser.add_argument('--angle-step', type=float, default=2, help="Rotation step in degrees in quantized mode")
+    parser.add_argument('--skew-step', type=float, default=10, help="Skew step (0-100%%) in quantized mode")
+    parser.add_argument('--no-seated-players', dest='seated_players', action='store_false',
+                        help="Leave out seated players (also disables active players and the dealer button)")
+    parser.add_argument('--no-active-players', dest='active_players', action='store_false', help="Leave out active players")
+    parser.add_argument('--no-dealer-button', dest='dealer_button', action='store_false', help="Leave out the dealer button")
+    parser.add_argument('--open-directory', action='store_true', help="Open the output directory when done")
+    parser.add_argument('--seed', type=int, default=None, help="Master seed for reproducible output")
+    parser.add_argument('--backend', choices=list(render_backends), default='pil',
+                        help="Compositing engine: pil, or numpy (single preallocated canvas, RGB output)")
+    parser.add_argument('--image-size', type=image_size_argument, default=(1024, 768), metavar='WxH',
+                        help="Canvas size; the table and sprites scale with it (default: 1024x768)")
+    parser.add_argument('--layout', choices=list(card_layouts), default='row',
+                        help="Card template: a row, an overlapping fan, or board cards plus two hole cards")
+    parser.add_argument('--seat-map', choices=list(seat_maps), default='six_max', help="Seats around the table")
+
+def table_features(args):
+    # Same rule as the GUI: active players and the dealer button sit next to seated players
+    if not args.seated_players:
+        return False, False, False
+    return args.active_players, args.seated_players, args.dealer_button
+
+def run_generate(args):
+    deck_path, deck_name = resolve_decks(args.deck)
+    include_active_players, include_seated_players, include_dealer_button = table_features(args)
+    result = generate_dataset(deck_path, deck_name, args.num_images, args.train_split, args.valid_split, args.test_split,
+                     args.brightness / 100, args.grain / 100, args.size_variation / 100, args.open_directory,
+                     include_active_players, include_seated_players, include_dealer_button, args.model,
+                     background_pool_size=args.background_pool_size, background_color_shift=args.background_color_shift,
+                     sprite_cache_mb=args.sprite_cache_mb, variant_cache_mb=args.variant_cache_mb,
+                     sprite_scale_mode=args.sprite_scale_mode,
+                     sprite_scale_buckets=args.sprite_scale_buckets, workers=args.workers, chunksize=args.chunksize,
+                     seed=args.seed, shard=args.shard, auto_tune=args.auto_tune,
+                     memory_limit_mb=args.memory_limit, resume=args.resume, image_format=args.format,
+                     compress_level=args.compress_level, quality=args.quality, writer_threads=args.writer_threads,
+                     writer_queue_size=args.writer_queue_size, label_batch_size=args.label_batch_size,
+                     output_mode=args.output_mode, shard_size=args.shard_size, output_dir=args.output_dir,
+                     telemetry=args.telemetry or args.report is not None, report_path=args.report,
+                     render_backend=args.backend, grain_style=args.grain_style, grain_bank_size=args.grain_bank_size,
+                     rotation_range=args.rotation, skew_range=args.skew / 100, transform_mode=args.transform_mode,
+                     angle_step=args.angle_step, skew_step=args.skew_step / 100, deck_weights=args.deck_weights,
+                     image_size=args.image_size, layout=args.layout, seat_map=args.seat_map)
+    # generate_dataset prints its own error; build servers only see the exit code
+    return 0 if result is not None else 1
+
+def run_sample(args):
+    deck_path, deck_name = resolve_deck(args.deck)
+    include_active_players, include_seated_players, include_dealer_button = table_features(args)
+    output_dir = generate_single_sample(deck_path, deck_name, args.brightness / 100, args.grain / 100, args.size_variation / 100,
+                           args.open_directory, include_active_players, include_seated_players, include_dealer_button,
+                           args.model, seed=args.seed, render_backend=args.backend, grain_style=args.grain_style,
+                           rotation_range=args.rotation, skew_range=args.skew / 100, transform_mode=args.transform_mode,
+                           angle_step=args.angle_step, skew_step=args.skew_step / 100, image_size=args.image_size,
+                           layout=args.layout, seat_map=args.seat_map)
+    return 0 if output_dir is not None else 1
+
+def run_expand(args):
+    expanded = expand_shards(args.dataset_dir, args.output_dir)
+    if expanded is None:
+        return 1
+    print(f"Expanded {expanded} samples into {args.output_dir or args.dataset_dir}")
+    return 0
+
+def run_extend(args):
+    result = extend_dataset(args.dataset_dir, args.num_images, seed=args.seed, workers=args.workers,
+                            chunksize=args.chunksize, telemetry=args.telemetry, auto_tune=args.auto_tune,
+                            memory_limit_mb=args.memory_limit)
+    return 0 if result is not None else 1
+
+def run_validate(args):
+    report = validate_dataset(args.dataset_dir, workers=args.workers, check_images=args.check_images,
+                              overlap_iou=args.overlap_iou, fail_on_overlap=args.fail_on_overlap)
+    if report is None:
+        return 1
+    print(format_report(report))
+    if args.report:
+        write_report(report, args.report)
+        print(f"Validation report written to {args.report}")
+    return 0 if report['passed'] else 1
+
+def run_compile_deck(args):
+    deck_path, deck_name = resolve_deck(args.deck)
+    try:
+        compiled = compile_deck_atlas(deck_path, force=args.force)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Compiled deck '{deck_name}'" if compiled else f"Deck '{deck_name}' is already compiled and up to date")
+
+def run_create_deck(args):
+    create_new_deck(args.name)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='imagefactory', description="Headless ImageFactory dataset generation")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help="Generate a full dataset")
+    add_render_arguments(generate_parser, multiple_decks=True)
+    generate_parser.add_argument('--output-dir', default=None,
+                                 help="Dataset directory (default: <deck>/generated_datasets/ImageFactory_<deck>_<model>_<num images>)")
+    generate_parser.add_argument('--num-images', type=int, default=20, help="Total number of images")
+    generate_parser.add_argument('--train-split', type=float, default=0.7, help="Train split (0-1)")
+    generate_parser.add_argument('--valid-split', type=float, default=0.2, help="Valid split (0-1)")
+    generate_parser.add_argument('--test-split', type=float, default=0.1, help="Test split (0-1)")
+    generate_parser.add_argument('--workers', type=int, default=None,
+                                 help="Worker processes (default: CPUs available, cgroup quota included)")
+    generate_parser.add_argument('--chunksize', type=int, default=8, help="Tasks handed to a worker at a time")
+    generate_parser.add_argument('--auto-tune', action='store_true',
+                                 help="Pick workers and chunksize from a short calibration run")
+    generate_parser.add_argument('--memory-limit', type=float, default=None,
+                                 help="RSS ceiling in MB for the whole run (default: 90%% of the cgroup limit, if any)")
+    generate_parser.add_argument('--background-pool-size', type=int, default=0,
+                                 help="Pre-rendered backgrounds per worker (0 renders one per image)")
+    generate_parser.add_argument('--background-color-shift', type=int, default=0,
+                                 help="Max per-channel color shift applied to pooled backgrounds; adds variety but "
+                                      "costs about as much as a fresh gradient, giving up the pool's speedup")
+    generate_parser.add_argument('--grain-bank-size', type=int, default=4,
+                                 help="Pre-generated grain textures per worker (about 3.5 MB each at 1024x768)")
+    generate_parser.add_argument('--sprite-cache-mb', type=int, default=64, help="Sprite cache size per worker (0 disables)")
+    generate_parser.add_argument('--variant-cache-mb', type=int, default=256,
+                                 help="Cache for quantized rotation/skew variants per worker, on top of --sprite-cache-mb "
+                                      "(0 keeps them in the sprite cache)")
+    generate_parser.add_argument('--sprite-scale-mode', choices=scale_modes, default='exact',
+                                 help="exact keeps today's continuous scaling, bucketed snaps scales to reuse sprites")
+    generate_parser.add_argument('--sprite-scale-buckets', type=int, default=16, help="Scale steps in bucketed mode")
+    generate_parser.add_argument('--shard', type=shard_argument, default=(0, 1),
+                                 help="Only generate shard k of N (k/N, k from 0); use the same --seed on every shard")
+    generate_parser.add_argument('--resume', action='store_true', help="Skip images whose image and label already exist and are valid")
+    generate_parser.add_argument('--format', choices=list(image_formats), default='png',
+                                 help="Image format: png, lossless webp or jpg")
+    generate_parser.add_argument('--compress-level', type=int, default=6, choices=range(10), metavar='0-9',
+                                 help="PNG zlib compression level, or lossless WebP effort (0-3 fastest, 9 smallest)")
+    generate_parser.add_argument('--quality', type=int, default=95, help="JPEG quality")
+    generate_parser.add_argument('--writer-threads', type=int, default=2,
+                                 help="Encoder/writer threads per worker (0 writes inline)")
+    generate_parser.add_argument('--writer-queue-size', type=int, default=8, help="Images buffered per worker for the writer")
+    generate_parser.add_argument('--label-batch-size', type=int, default=1, help="Write label files in batches of this size")
+    generate_parser.add_argument('--output-mode', choices=['files', 'tar'], default='files',
+                                 help="files writes one image and label per sample, tar streams samples into shard archives")
+    generate_parser.add_argument('--shard-size', type=int, default=1000, help="Samples per tar shard")
+    generate_parser.add_argument('--telemetry', action='store_true',
+                                 help="Time each pipeline stage and print a run report (also saved as run_report.json)")
+    generate_parser.add_argument('--report', default=None, help="Write the run report JSON here (implies --telemetry)")
+    generate_parser.set_defaults(func=run_generate)
+
+    sample_parser = subparsers.add_parser('sample', help="Generate a single sample image")
+    add_render_arguments(sample_parser)
+    sample_parser.set_defaults(func=run_sample)
+
+    expand_parser = subparsers.add_parser('expand', help="Unpack tar shards into the images/labels directory layout")
+    expand_parser.add_argument('dataset_dir', help="Dataset directory containing shards/")
+    expand_parser.add_argument('--output-dir', default=None, help="Where to expand to (default: the dataset directory)")
+    expand_parser.set_defaults(func=run_expand)
+
+    extend_parser = subparsers.add_parser('extend', help="Add images to a dataset with the parameters it was made with")
+    extend_parser.add_argument('dataset_dir', help="Dataset directory containing manifest.json")
+    extend_parser.add_argument('--num-images', type=int, required=True, help="Number of images to add")
+    extend_parser.add_argument('--seed', type=int, default=None,
+                               help="Seed for the new images (default: the dataset's seed, which matches a single larger run)")
+    extend_parser.add_argument('--workers', type=int, default=None,
+                               help="Worker processes (default: CPUs available, cgroup quota included)")
+    extend_parser.add_argument('--chunksize', type=int, default=8, help="Tasks handed to a worker at a time")
+    extend_parser.add_argument('--auto-tune', action='store_true',
+                               help="Pick workers and chunksize from a short calibration run")
+    extend_parser.add_argument('--memory-limit', type=float, default=None,
+                               help="RSS ceiling in MB for the whole run (default: 90%% of the cgroup limit, if any)")
+    extend_parser.add_argument('--telemetry', action='store_true', help="Collect per-stage timings and print a run report")
+    extend_parser.set_defaults(func=run_extend)
+
+    validate_parser = subparsers.add_parser('validate', help="Check a dataset's labels and report class and box statistics")
+    validate_parser.add_argument('dataset_dir', help="Dataset directory (images/labels layout or shards/)")
+    validate_parser.add_argument('--report', default=None, help="Write the full report as JSON here")
+    validate_parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    validate_parser.add_argument('--check-images', action='store_true',
+                                 help="Also open and verify every image (much slower than labels only)")
+    validate_parser.add_argument('--overlap-iou', type=float, default=0.5,
+                                 help="Boxes in one image overlapping by more than this IoU are reported")
+    validate_parser.add_argument('--fail-on-overlap', action='store_true', help="Treat overlapping boxes as errors")
+    validate_parser.set_defaults(func=run_validate)
+
+    compile_parser = subparsers.add_parser('compile-deck',
+                               help="Decode a deck's assets into a memory-mapped atlas shared by workers")
+    compile_parser.add_argument('--deck', required=True, help="Deck name under ./deck or path to a deck directory")
+    compile_parser.add_argument('--force', action='store_true', help="Rebuild even if the atlas is up to date")
+    compile_parser.set_defaults(func=run_compile_deck)
+
+    create_deck_parser = subparsers.add_parser('create-deck', help="Create an empty deck directory layout")
+    create_deck_parser.add_argument('name', help="New deck name")
+    create_deck_parser.set_defaults(func=run_create_deck)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# Where cards and players go on a canvas of any size. Templates are written once in a 1024x768
+# reference frame and resolved to pixel anchors when a Layout is built, once per run, so per image
+# the renderer only picks from precomputed lists. Positions scale with the canvas on each axis and
+# sprites by the smaller of the two, so 640x640 renders a squeezed table at training resolution.
+# The 'row' cards with the 'six_max' seats at 1024x768 are the original hard-coded layout, pixel for pixel.
+reference_size = (1024, 768)
+
+# Card templates: a list of variants, each a list of card groups. 'row' groups are spaced evenly
+# with the row centered on the anchor; 'fan' groups overlap by step (share of the card width)
+# and tilt from +spread to -spread degrees, dropping arc pixels per step away from the middle.
+# A group without a count takes the run's number of cards.
+card_layouts = {
+    'row': [
+        [{'kind': 'row', 'center': (512, 384)}],
+    ],
+    'fan': [
+        [{'kind': 'fan', 'center': (512, 384), 'spread': 12, 'step': 0.5, 'arc': 8}],
+    ],
+    # Flop, turn or river on the board plus two hole cards above the bottom seat
+    'board': [
+        [{'kind': 'row', 'center': (512, 330), 'count': count},
+         {'kind': 'fan', 'center': (512, 490), 'count': 2, 'spread': 6, 'step': 0.6, 'arc': 0}]
+        for count in (3, 4, 5)
+    ],
+}
+
+# Seats: name, reference position and the side the dealer button goes on (x, y), as -1, 0 or 1.
+# The button sits that way from the seat, past half the seat size plus a small gap.
+seat_maps = {
+    'six_max': [
+        ('top_left', (128, 180), (1, 1)),
+        ('top_middle', (512, 150), (0, 1)),
+        ('top_right', (896, 180), (-1, 1)),
+        ('bottom_left', (128, 588), (1, -1)),
+        ('bottom_middle', (512, 668), (1, -1)),
+        ('bottom_right', (896, 588), (-1, -1)),
+    ],
+    'heads_up': [
+        ('top_middle', (512, 150), (0, 1)),
+        ('bottom_middle', (512, 668), (1, -1)),
+    ],
+    'eight_max': [
+        ('top_left', (128, 180), (1, 1)),
+        ('top_center_left', (384, 150), (1, 1)),
+        ('top_center_right', (640, 150), (-1, 1)),
+        ('top_right', (896, 180), (-1, 1)),
+        ('bottom_left', (128, 588), (1, -1)),
+        ('bottom_center_left', (384, 668), (1, -1)),
+        ('bottom_center_right', (640, 668), (-1, -1)),
+        ('bottom_right', (896, 588), (-1, -1)),
+    ],
+}
+
+player_gap = 20  # reference pixels between a seat and its active marker or dealer button
+
+def parse_image_size(value):
+    # '640x640' -> (640, 640)
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Invalid image size '{value}', expected WIDTHxHEIGHT")
+    if width < 64 or height < 64:
+        raise ValueError(f"Invalid image size '{value}', both sides must be at least 64 pixels")
+    return width, height
+
+class Layout:
+    def __init__(self, image_size=reference_size, cards='row', seats='six_max', space_between=50):
+        if cards not in card_layouts:
+            raise ValueError(f"Unknown card layout '{cards}', expected one of {list(card_layouts)}")
+        if seats not in seat_maps:
+            raise ValueError(f"Unknown seat map '{seats}', expected one of {list(seat_maps)}")
+        self.image_size = tuple(image_size)
+        self.x_scale = self.image_size[0] / reference_size[0]
+        self.y_scale = self.image_size[1] / reference_size[1]
+        # Sprites keep their aspect ratio, so they follow the tighter axis
+        self.scale = min(self.x_scale, self.y_scale)
+        self.space = self.scaled(space_between)
+        self.gap = self.scaled(player_gap)
+        self.seats = [(name, self.point(position), side) for name, position, side in seat_maps[seats]]
+        self.card_variants = [[dict(group, center=self.point(group['center'])) for group in variant]
+                              for variant in card_layouts[cards]]
+        self.plans = {}
+
+    def point(self, position):
+        return round(position[0] * self.x_scale), round(position[1] * self.y_scale)
+
+    def scaled(self, value):
+        return int(value * self.scale)
+
+    def sample_cards(self, rng, num_cards):
+        # A card plan: (group, count, angles) per group. Single-variant templates draw nothing.
+        variant = 0 if len(self.card_variants) == 1 else rng.randrange(len(self.card_variants))
+        plan = self.plans.get((variant, num_cards))
+        if plan is None:
+            plan = []
+            for group in self.card_variants[variant]:
+                count = group.get('count', num_cards)
+                middle = (count - 1) / 2
+                spread = group.get('spread', 0)
+                angles = [spread * (middle - i) / middle if middle else 0 for i in range(count)]
+                plan.append((group, count, angles))
+            self.plans[(variant, num_cards)] = plan
+        return plan
+
+    def place_cards(self, plan, sizes):
+        # Top-left corner for each card sprite, in plan order
+        positions = []
+        for group, count, _ in plan:
+            group_sizes, sizes = sizes[:count], sizes[count:]
+            center_x, center_y = group['center']
+            if group['kind'] == 'row':
+                # Each card's own width sets its slot, as the original row did
+                for i, (width, height) in enumerate(group_sizes):
+                    positions.append(((2 * center_x - count * (width + self.space)) // 2 + i * (width + self.space),
+                                      (2 * center_y - height) // 2))
+            else:
+                step = group['step'] * max(width for width, _ in group_sizes)
+                middle = (count - 1) / 2
+                for i, (width, height) in enumerate(group_sizes):
+                    offset = i - middle
+                    x = center_x + round(offset * step)
+                    y = center_y + round(group['arc'] * self.y_scale * offset * offset)
+                    positions.append((x - width // 2, y - height // 2))
+        return positions
+
+    def dealer_position(self, position, side, seat_size):
+        # Where the dealer button goes for a seat at position with the given (scaled) size
+        (seat_x, seat_y), (side_x, side_y) = position, side
+        return (seat_x + side_x * (seat_size[0] // 2 + self.gap),
+                seat_y + side_y * (seat_size[1] // 2 + self.gap))
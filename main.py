@@ -1,21 +1,69 @@
+import multiprocessing
 import os
+import queue
+import random
+import time
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import ttk, filedialog, messagebox, simpledialog
 from tkinter.font import Font
+from PIL import ImageTk
 
-from factory_helpers import generate_dataset, generate_single_sample, create_new_deck, find_decks
+from factory_helpers import generate_dataset, create_new_deck, find_decks
+from preview import PreviewServer
 
 def start_gui():
+    # Dataset generation runs on a background thread (the pool does the work in its own processes);
+    # progress comes back through a queue that the Tk loop polls with root.after
+    executor = ThreadPoolExecutor(max_workers=1)
+    progress_queue = queue.Queue()
+    generation = {}
+    # Samples are rendered by a warm preview process and shown in a Preview window. Slider and
+    # checkbox changes re-render the same layout after a short pause; Generate Sample picks a new one.
+    # Started before Tk so the forked process does not inherit the Tk connection.
+    preview_server = PreviewServer()
+    preview = {'seed': None, 'pending': None, 'window': None, 'photo': None}
+    preview_size = (768, 576)
+    preview_debounce_ms = 120
+
+    # (path, weight) for every deck in the run; Add Deck mixes more decks into the same dataset
+    selected_decks = []
+
+    def show_decks():
+        names = [os.path.basename(os.path.normpath(path)) for path, _ in selected_decks]
+        if len(selected_decks) == 1:
+            deck_name_var.set(names[0])
+        else:
+            deck_name_var.set(" + ".join(f"{name} ({weight:g})" for name, (_, weight) in zip(names, selected_decks)))
+
     def select_deck():
         selected_deck = filedialog.askdirectory(initialdir='ImageFactory/deck', title='Select Deck')
         if selected_deck:
-            deck_name = os.path.basename(selected_deck)
-            deck_name_var.set(deck_name)
-            deck_path_var.set(selected_deck)
+            selected_decks[:] = [(selected_deck, 1.0)]
+            show_decks()
+
+    def add_deck():
+        added_deck = filedialog.askdirectory(initialdir='ImageFactory/deck', title='Add Deck')
+        if not added_deck:
+            return
+        weight = simpledialog.askfloat("Deck Weight", "Relative share of images from this deck:", initialvalue=1.0,
+                                       minvalue=0.0, parent=root)
+        if weight is not None:
+            selected_decks.append((added_deck, weight))
+            show_decks()
+
+    def run_decks():
+        # What generate_dataset takes: a single path, or a list of paths with weights
+        names = [os.path.basename(os.path.normpath(path)) for path, _ in selected_decks]
+        if len(selected_decks) == 1:
+            return selected_decks[0][0], names[0], None
+        return [path for path, _ in selected_decks], '+'.join(names), [weight for _, weight in selected_decks]
 
     def on_generate():
-        deck_name = deck_name_var.get()
-        deck_path = deck_path_var.get()
+        if not selected_decks:
+            messagebox.showerror("Error", "Please select a deck.")
+            return
+        deck_path, deck_name, deck_weights = run_decks()
         num_images = int(num_images_entry.get())
         train_split = float(train_split_entry.get())
         valid_split = float(valid_split_entry.get())
@@ -29,9 +77,63 @@ def start_gui():
         include_dealer_button = dealer_button_var.get()
         selected_model = model_selector.get()
 
-        generate_dataset(deck_path, deck_name, num_images, train_split, valid_split, test_split, brightness_range,
-                         grain_range, size_variation, open_directory, include_active_players, include_seated_players,
-                         include_dealer_button, selected_model)
+        cancel_event = multiprocessing.Event()
+        generation.update(future=None, cancel_event=cancel_event, started=time.perf_counter())
+        generate_button.state(['disabled'])
+        cancel_button.state(['!disabled'])
+        progress_bar.config(value=0, maximum=max(1, num_images))
+        status_var.set("Starting workers...")
+
+        generation['future'] = executor.submit(
+            generate_dataset, deck_path, deck_name, num_images, train_split, valid_split, test_split, brightness_range,
+            grain_range, size_variation, open_directory, include_active_players, include_seated_players,
+            include_dealer_button, selected_model, show_progress=False, deck_weights=deck_weights,
+            progress_callback=lambda done, total: progress_queue.put((done, total)), cancel_event=cancel_event)
+        root.after(200, poll_generation)
+
+    def on_cancel():
+        if generation.get('cancel_event') is not None:
+            generation['cancel_event'].set()
+            cancel_button.state(['disabled'])
+            status_var.set("Cancelling, finishing images in flight...")
+
+    def poll_generation():
+        latest = None
+        while True:
+            try:
+                latest = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+        if latest is not None and not generation['cancel_event'].is_set():
+            done, total = latest
+            elapsed = time.perf_counter() - generation['started']
+            rate = done / elapsed if elapsed > 0 else 0
+            eta = (total - done) / rate if rate > 0 else 0
+            progress_bar.config(value=done, maximum=max(1, total))
+            status_var.set(f"{done}/{total} images, {rate:.1f} img/s, ETA {int(eta // 60)}:{int(eta % 60):02d}")
+
+        future = generation['future']
+        if not future.done():
+            root.after(200, poll_generation)
+            return
+
+        generate_button.state(['!disabled'])
+        cancel_button.state(['disabled'])
+        try:
+            result = future.result()
+        except Exception as e:
+            status_var.set("Generation failed")
+            messagebox.showerror("Error", str(e))
+            return
+        if result is None:
+            status_var.set("Generation failed, see console output")
+        elif result['cancelled']:
+            written = result['generated'] + result['skipped']
+            status_var.set(f"Cancelled after {written}/{result['total']} images (seed {result['seed']})")
+        else:
+            elapsed = time.perf_counter() - generation['started']
+            progress_bar.config(value=result['total'], maximum=max(1, result['total']))
+            status_var.set(f"Done: {result['total']} images in {elapsed:.1f}s")
 
     def on_create_deck():
         deck_name = new_deck_name_entry.get()
@@ -41,19 +143,59 @@ def start_gui():
             messagebox.showerror("Error", "Please enter a deck name.")
 
     def on_generate_sample():
-        deck_name = deck_name_var.get()
-        deck_path = deck_path_var.get()
-        brightness_range = brightness_slider.get() / 100
-        grain_range = grain_slider.get() / 100
-        size_variation = size_variation_slider.get() / 100
-        open_directory = open_directory_var.get()
-        include_active_players = active_players_var.get()
-        include_seated_players = seated_players_var.get()
-        include_dealer_button = dealer_button_var.get()
-        selected_model = model_selector.get()
-
-        generate_single_sample(deck_path, deck_name, brightness_range, grain_range, size_variation, open_directory,
-                               include_active_players, include_seated_players, include_dealer_button, selected_model)
+        if not selected_decks:
+            messagebox.showerror("Error", "Please select a deck.")
+            return
+        preview['seed'] = random.randrange(2 ** 32)
+        request_preview()
+
+    def request_preview():
+        if preview['pending'] is not None:
+            root.after_cancel(preview['pending'])
+            preview['pending'] = None
+        deck_path, _, deck_weights = run_decks()
+        options = {
+            'brightness_range': brightness_slider.get() / 100,
+            'grain_range': grain_slider.get() / 100,
+            'size_variation': size_variation_slider.get() / 100,
+            'include_active_players': active_players_var.get(),
+            'include_seated_players': seated_players_var.get(),
+            'include_dealer_button': dealer_button_var.get(),
+            'deck_weights': deck_weights,
+        }
+        preview_server.request(deck_path, options, preview['seed'], preview_size=preview_size)
+
+    def schedule_preview(*_):
+        # Debounced: a slider drag sends one request once it pauses, not one per pixel of movement
+        if preview['seed'] is None or not selected_decks:
+            return
+        if preview['pending'] is not None:
+            root.after_cancel(preview['pending'])
+        preview['pending'] = root.after(preview_debounce_ms, request_preview)
+
+    def show_preview(image, annotations, seconds):
+        if preview['window'] is None or not preview['window'].winfo_exists():
+            window = tk.Toplevel(root)
+            window.title("Preview")
+            preview['label'] = ttk.Label(window)
+            preview['label'].grid(row=0, column=0)
+            preview['status'] = tk.StringVar()
+            ttk.Label(window, textvariable=preview['status']).grid(row=1, column=0, sticky=tk.W, padx=10, pady=5)
+            preview['window'] = window
+        # Tk only draws a PhotoImage while a reference to it exists
+        preview['photo'] = ImageTk.PhotoImage(image)
+        preview['label'].config(image=preview['photo'])
+        preview['status'].set(f"Seed {preview['seed']}, {len(annotations)} objects, rendered in {seconds * 1000:.0f} ms")
+
+    def poll_preview():
+        reply = preview_server.poll()
+        if reply is not None:
+            _, image, annotations, error, seconds = reply
+            if error is not None:
+                messagebox.showerror("Error", error)
+            else:
+                show_preview(image, annotations, seconds)
+        root.after(30, poll_preview)
 
     def on_seated_players_checked():
         if not seated_players_var.get():
@@ -64,6 +206,7 @@ def start_gui():
         else:
             active_players_checkbutton.state(['!disabled'])
             dealer_button_checkbutton.state(['!disabled'])
+        schedule_preview()
 
     root = tk.Tk()
     root.title("Dataset Generator")
@@ -72,7 +215,6 @@ def start_gui():
     mainframe.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
 
     deck_name_var = tk.StringVar()
-    deck_path_var = tk.StringVar()
     open_directory_var = tk.BooleanVar(value=True)
     active_players_var = tk.BooleanVar(value=True)
     seated_players_var = tk.BooleanVar(value=True)
@@ -84,13 +226,15 @@ def start_gui():
 
     decks = find_decks()
     if decks:
-        deck_name_var.set(decks[0])
-        deck_path_var.set(os.path.join(os.getcwd(), 'deck', decks[0]))
+        selected_decks.append((os.path.join(os.getcwd(), 'deck', decks[0]), 1.0))
+        show_decks()
 
     # Select Deck Section
     ttk.Label(mainframe, textvariable=deck_name_var).grid(row=0, column=1, sticky=(tk.W, tk.E), **section_padding)
     select_deck_button = ttk.Button(mainframe, text="Select Deck", command=select_deck)
     select_deck_button.grid(row=0, column=0, sticky=tk.W, **section_padding)
+    add_deck_button = ttk.Button(mainframe, text="Add Deck", command=add_deck)
+    add_deck_button.grid(row=0, column=2, sticky=(tk.W, tk.E), **section_padding)
 
     ttk.Separator(mainframe, orient='horizontal').grid(row=1, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
 
@@ -126,7 +270,7 @@ def start_gui():
     brightness_slider.grid(row=8, column=1, sticky=(tk.W, tk.E), **section_padding)
     brightness_value_label = ttk.Label(mainframe, text="40%")
     brightness_value_label.grid(row=8, column=2, sticky=tk.W, **section_padding)
-    brightness_slider.config(command=lambda v: brightness_value_label.config(text=f"{int(float(v))}%"))
+    brightness_slider.config(command=lambda v: (brightness_value_label.config(text=f"{int(float(v))}%"), schedule_preview()))
 
     ttk.Label(mainframe, text="Grain Variation (0-100%):").grid(row=9, column=0, sticky=tk.W, **section_padding)
     grain_slider = ttk.Scale(mainframe, from_=0, to_=100, orient=tk.HORIZONTAL)
@@ -134,7 +278,7 @@ def start_gui():
     grain_slider.grid(row=9, column=1, sticky=(tk.W, tk.E), **section_padding)
     grain_value_label = ttk.Label(mainframe, text="0%")
     grain_value_label.grid(row=9, column=2, sticky=tk.W, **section_padding)
-    grain_slider.config(command=lambda v: grain_value_label.config(text=f"{int(float(v))}%"))
+    grain_slider.config(command=lambda v: (grain_value_label.config(text=f"{int(float(v))}%"), schedule_preview()))
 
     ttk.Label(mainframe, text="Size Variation (0-100%):").grid(row=10, column=0, sticky=tk.W, **section_padding)
     size_variation_slider = ttk.Scale(mainframe, from_=0, to_=100, orient=tk.HORIZONTAL)
@@ -142,15 +286,17 @@ def start_gui():
     size_variation_slider.grid(row=10, column=1, sticky=(tk.W, tk.E), **section_padding)
     size_variation_value_label = ttk.Label(mainframe, text="25%")
     size_variation_value_label.grid(row=10, column=2, sticky=tk.W, **section_padding)
-    size_variation_slider.config(command=lambda v: size_variation_value_label.config(text=f"{int(float(v))}%"))
+    size_variation_slider.config(command=lambda v: (size_variation_value_label.config(text=f"{int(float(v))}%"), schedule_preview()))
 
     ttk.Label(mainframe, text="Table Features", font=bold_font).grid(row=11, column=0, columnspan=3, sticky=tk.W, **section_padding)
 
     ttk.Checkbutton(mainframe, text="Seated Players", variable=seated_players_var,
                     command=on_seated_players_checked).grid(row=12, column=0, sticky=tk.W, **section_padding)
-    active_players_checkbutton = ttk.Checkbutton(mainframe, text="Active Players", variable=active_players_var)
+    active_players_checkbutton = ttk.Checkbutton(mainframe, text="Active Players", variable=active_players_var,
+                                                 command=schedule_preview)
     active_players_checkbutton.grid(row=13, column=0, sticky=tk.W, padx=40, pady=0)
-    dealer_button_checkbutton = ttk.Checkbutton(mainframe, text="Dealer Button", variable=dealer_button_var)
+    dealer_button_checkbutton = ttk.Checkbutton(mainframe, text="Dealer Button", variable=dealer_button_var,
+                                                command=schedule_preview)
     dealer_button_checkbutton.grid(row=14, column=0, sticky=tk.W, padx=40, pady=0)
 
     # Model Selector
@@ -171,6 +317,10 @@ def start_gui():
     generate_button = ttk.Button(button_frame, text="Generate Entire Dataset", command=on_generate)
     generate_button.grid(row=0, column=1, padx=5)
 
+    cancel_button = ttk.Button(button_frame, text="Cancel", command=on_cancel)
+    cancel_button.grid(row=0, column=2, padx=5)
+    cancel_button.state(['disabled'])
+
     # Center the frame within the mainframe
     button_frame.grid_columnconfigure(0, weight=1)
     button_frame.grid_columnconfigure(1, weight=1)
@@ -180,9 +330,13 @@ def start_gui():
     ttk.Checkbutton(mainframe, text="Open deck directory after generating dataset", variable=open_directory_var).grid(
         row=18, column=0, columnspan=3, sticky=tk.W, padx=50, pady=10)
 
-    tk.Label(mainframe,
-             text="Note: a large number of images (like 1000+) might lock up the main thread for a while too",
-             wraplength=300).grid(row=19, column=0, columnspan=3, sticky=tk.W, padx=50, pady=10)
+    progress_frame = ttk.Frame(mainframe)
+    progress_frame.grid(row=19, column=0, columnspan=3, sticky=(tk.W, tk.E), padx=10, pady=10)
+    progress_frame.grid_columnconfigure(0, weight=1)
+    progress_bar = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, mode='determinate')
+    progress_bar.grid(row=0, column=0, sticky=(tk.W, tk.E))
+    status_var = tk.StringVar(value="Idle")
+    ttk.Label(progress_frame, textvariable=status_var).grid(row=1, column=0, sticky=tk.W, pady=5)
 
     ttk.Separator(mainframe, orient='horizontal').grid(row=20, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
 
@@ -194,6 +348,16 @@ def start_gui():
     create_deck_button = ttk.Button(mainframe, text="Create Deck", command=on_create_deck)
     create_deck_button.grid(row=21, column=2, sticky=(tk.W, tk.E), **section_padding)
 
+    def on_close():
+        # Let a running job stop cleanly instead of leaving orphaned workers behind
+        if generation.get('cancel_event') is not None:
+            generation['cancel_event'].set()
+        executor.shutdown(wait=True)
+        preview_server.close()
+        root.destroy()
+
+    root.protocol("WM_DELETE_WINDOW", on_close)
+    root.after(30, poll_preview)
     root.mainloop()
 
 
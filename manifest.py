@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+from output_writer import write_file
+
+# manifest.json sits next to data.yaml and records how a dataset was made: the parameters needed to
+# render more of it, how many indices each split has used, and one entry per generate/extend run
+# with the index ranges it covered. extend_dataset reads it to continue where the dataset stops.
+# A cancelled run leaves the counts alone and is recorded as pending until a resume finishes it.
+manifest_name = 'manifest.json'
+
+# generate_dataset arguments that change what gets rendered, stored so an extend matches the original
+manifest_parameters = [
+    'brightness_range', 'grain_range', 'grain_style', 'grain_bank_size', 'size_variation', 'rotation_range',
+    'skew_range', 'transform_mode', 'angle_step', 'skew_step', 'include_active_players', 'include_seated_players',
+    'include_dealer_button', 'selected_model', 'background_pool_size', 'background_color_shift', 'sprite_cache_mb',
+    'variant_cache_mb', 'sprite_scale_mode', 'sprite_scale_buckets', 'image_format', 'compress_level', 'quality', 'label_batch_size',
+    'output_mode', 'shard_size', 'render_backend', 'deck_weights', 'image_size', 'layout', 'seat_map',
+]
+# Parameters that only change speed or file size, free to differ when resuming
+tuning_parameters = ['sprite_cache_mb', 'variant_cache_mb', 'compress_level', 'label_batch_size']
+
+def changed_parameters(manifest, options):
+    # Rendering parameters that differ from the ones the dataset was made with
+    return [name for name in manifest_parameters if name not in tuning_parameters and
+            name in manifest['parameters'] and options[name] != manifest['parameters'][name]]
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, manifest_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def record_run(manifest, output_dir, deck_path, deck_name, num_images, splits, split_counts, split_starts, options,
+               status_counts, cancelled=False):
+    # manifest is the one the run started from, or None for a new dataset. A cancelled run has gaps
+    # anywhere in its ranges, so counts and num_images stay at the last finished run and the run is
+    # kept as pending for --resume to finish.
+    manifest = manifest or {'runs': []}
+    counts = dict(manifest.get('counts', {}))
+    for split, count in split_counts.items():
+        counts[split] = max(counts.get(split, 0), split_starts.get(split, 0) + count)
+    if cancelled:
+        manifest['pending'] = {'num_images': num_images, 'seed': options['seed'], 'counts': counts}
+    else:
+        manifest.pop('pending', None)
+        manifest.update({'num_images': num_images, 'counts': counts})
+    manifest.update({
+        'deck_path': deck_path,
+        'deck_name': deck_name,
+        'seed': manifest.get('seed', options['seed']),
+        'num_images': manifest.get('num_images', 0),
+        'splits': splits,
+        'counts': manifest.get('counts', {}),
+        'parameters': {name: options[name] for name in manifest_parameters},
+    })
+    manifest['runs'].append({
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': options['seed'],
+        'shard': list(options['shard']),
+        'ranges': {split: [split_starts.get(split, 0), split_starts.get(split, 0) + count]
+                   for split, count in split_counts.items()},
+        'generated': status_counts['generated'],
+        'skipped': status_counts['skipped'],
+        'cancelled': cancelled,
+        'parameters': {name: options[name] for name in manifest_parameters},
+    })
+    write_file(os.path.join(output_dir, manifest_name), json.dumps(manifest, indent=1))
+    return manifest
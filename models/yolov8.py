@@ -3,14 +3,9 @@ import os
 import yaml
 
 
-def save_annotations_and_metadata(output_dir, card_names, include_dealer_button, include_active_players, include_seated_players, deck_name, model, num_images):
-    selected_classes = card_names[:]
-    if include_seated_players:
-        selected_classes.append('PlayerSeated')
-    if include_active_players:
-        selected_classes.append('PlayerActive')
-    if include_dealer_button:
-        selected_classes.append('DealerButton')
+def save_annotations_and_metadata(output_dir, card_names, deck_name, model, num_images, image_format='png'):
+    # The class map is fixed: labels use these indices whether or not the table features are drawn
+    selected_classes = card_names + ['PlayerSeated', 'PlayerActive', 'DealerButton']
 
     data = {
         'path': f'../drive/MyDrive/Datasets/ImageFactory_{deck_name}_{model}_{num_images}',
@@ -18,7 +13,8 @@ def save_annotations_and_metadata(output_dir, card_names, include_dealer_button,
         'val': '../valid/images',
         'test': '../test/images',
         'nc': len(selected_classes),
-        'names': selected_classes
+        'names': selected_classes,
+        'image_format': image_format
     }
 
     with open(os.path.join(output_dir, 'data.yaml'), 'w') as f:
@@ -0,0 +1,146 @@
+import io
+import os
+import queue
+import threading
+import time
+
+from telemetry import null_telemetry
+
+# Output format name -> (Pillow format, file extension)
+image_formats = {
+    'png': ('PNG', 'png'),
+    'webp': ('WEBP', 'webp'),
+    'jpg': ('JPEG', 'jpg'),
+}
+
+# Lossless WebP effort (method, quality) per compress_level. Pillow's default (4, 80) takes about
+# 7x as long as PNG level 6 on a 1024x768 image; method 0 is as fast as PNG level 1 but larger,
+# method 1 with quality 0 is about half the default's time at nearly the same size.
+webp_efforts = [(0, 100)] * 4 + [(1, 0)] * 3 + [(4, 75)] * 2 + [(6, 50)]
+
+def image_extension(image_format):
+    return image_formats[image_format][1]
+
+def format_annotations(annotations):
+    return "\n".join(f"{class_index} {center_x} {center_y} {width} {height}"
+                     for class_index, center_x, center_y, width, height in annotations)
+
+def encode_image(image, image_format='png', compress_level=6, quality=95):
+    pil_format = image_formats[image_format][0]
+    buffer = io.BytesIO()
+    if image_format == 'png':
+        image.save(buffer, format=pil_format, compress_level=compress_level)
+    elif image_format == 'webp':
+        method, effort = webp_efforts[compress_level]
+        image.save(buffer, format=pil_format, lossless=True, method=method, quality=effort)
+    else:
+        image.convert('RGB').save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue()
+
+def write_file(path, data):
+    # Written to a temporary name and renamed into place so an interrupted run never leaves a
+    # truncated file behind
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    with open(path + '.tmp', mode) as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+class DirectorySink:
+    # Today's layout: <split>/images/<key>.<ext> and <split>/labels/<key>.txt. Label files can be
+    # written in batches of label_batch_size; each label still lands after its image so a label on
+    # disk always marks a complete pair.
+    def __init__(self, output_dir, label_batch_size=1):
+        self.output_dir = output_dir
+        self.label_batch_size = max(1, label_batch_size)
+        self.pending_labels = []
+        self.labels_lock = threading.Lock()
+
+    def paths(self, split, key, extension):
+        return (os.path.join(self.output_dir, split, 'images', f'{key}.{extension}'),
+                os.path.join(self.output_dir, split, 'labels', f'{key}.txt'))
+
+    def write(self, split, key, extension, image_data, label):
+        image_path, label_path = self.paths(split, key, extension)
+        write_file(image_path, image_data)
+        if self.label_batch_size == 1:
+            write_file(label_path, label)
+            return
+        with self.labels_lock:
+            self.pending_labels.append((label_path, label))
+            if len(self.pending_labels) < self.label_batch_size:
+                return
+            batch, self.pending_labels = self.pending_labels, []
+        for path, label in batch:
+            write_file(path, label)
+
+    def close(self):
+        with self.labels_lock:
+            batch, self.pending_labels = self.pending_labels, []
+        for path, label in batch:
+            write_file(path, label)
+
+class OutputWriter:
+    # Encodes samples on a small thread pool fed by a bounded queue and hands the bytes to a sink,
+    # so PNG/WebP/JPEG encoding and I/O overlap with rendering the next image. Pillow releases the
+    # GIL while encoding. A full queue blocks submit(), which keeps memory bounded when the disk
+    # falls behind. threads=0 writes synchronously.
+    def __init__(self, sink, image_format='png', compress_level=6, quality=95, threads=2, queue_size=8,
+                 telemetry=null_telemetry):
+        if image_format not in image_formats:
+            raise ValueError(f"Unknown image format '{image_format}', expected one of {list(image_formats)}")
+        self.sink = sink
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.quality = quality
+        self.telemetry = telemetry
+        self.error = None
+        self.queue = queue.Queue(max(1, queue_size))
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, image, split, key, annotations, started=None):
+        self._raise_error()
+        item = (image, split, key, annotations, started)
+        if self.threads:
+            with self.telemetry.stage('queue_put_wait'):
+                self.queue.put(item)
+        else:
+            self._write(item)
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.sink.close()
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            with self.telemetry.stage('queue_get_wait'):
+                item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self._write(item)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+    def _write(self, item):
+        image, split, key, annotations, started = item
+        with self.telemetry.stage('encode'):
+            image_data = encode_image(image, self.image_format, self.compress_level, self.quality)
+        label = format_annotations(annotations)
+        with self.telemetry.stage('write'):
+            self.sink.write(split, key, image_extension(self.image_format), image_data, label)
+        self.telemetry.count('bytes_written', len(image_data) + len(label))
+        if started is not None:
+            self.telemetry.record_image(time.perf_counter() - started)
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
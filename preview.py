@@ -0,0 +1,120 @@
+import multiprocessing
+import queue
+import random
+import time
+from PIL import Image, ImageDraw
+
+from factory_helpers import card_names, deck_list, init_render_state, prepare_deck_atlas, render_task_image, \
+    seeded_background_pool
+from streaming import render_options
+
+# A long-lived process that keeps decks decoded and the render state warm for the GUI. Requests are
+# (request_id, deck_path, seed, index, options, preview_size); the reply carries the rendered image
+# with its bounding boxes drawn, already scaled to preview_size. Only the newest pending request is
+# rendered, so dragging a slider never builds up a backlog. The preview shows the image a dataset run
+# with the same seed and options writes as train_<index>, except for grain: the noise bank takes a
+# few hundred ms to fill, so it is built once from preview_seed and kept across sample seeds.
+preview_seed = 0
+
+box_colors = {'card': (255, 64, 64), 'PlayerSeated': (64, 160, 255), 'PlayerActive': (64, 255, 96),
+              'DealerButton': (255, 200, 0)}
+class_names = card_names + ['PlayerSeated', 'PlayerActive', 'DealerButton']
+
+# Options read when the render state is built; changing one of these rebuilds it, anything else
+# is picked up by the next render. A new seed only redraws the background pool and a new size
+# variation is handed to the sprite cache, so neither reloads the deck or drops the cache.
+state_options = ['background_pool_size', 'background_color_shift', 'grain_style', 'grain_bank_size',
+                 'render_backend', 'sprite_cache_mb', 'variant_cache_mb', 'sprite_scale_mode', 'sprite_scale_buckets',
+                 'image_size', 'layout', 'seat_map']
+
+def draw_annotations(image, annotations):
+    draw = ImageDraw.Draw(image)
+    width, height = image.size
+    for class_index, center_x, center_y, box_width, box_height in annotations:
+        name = class_names[class_index]
+        color = box_colors.get(name, box_colors['card'])
+        left, top = (center_x - box_width / 2) * width, (center_y - box_height / 2) * height
+        right, bottom = (center_x + box_width / 2) * width, (center_y + box_height / 2) * height
+        draw.rectangle((left, top, right, bottom), outline=color, width=2)
+        draw.text((left + 3, top + 2), name, fill=color)
+    return image
+
+def render_preview(state, index, preview_size):
+    image, annotations = render_task_image(state, 'train', index)
+    image = draw_annotations(image.convert('RGB'), annotations)
+    if preview_size is not None and preview_size != image.size:
+        image = image.resize(preview_size, Image.BILINEAR)
+    return image, annotations
+
+def preview_worker(requests, replies):
+    state = None
+    state_key = None
+    pool_seed = None
+    while True:
+        request = requests.get()
+        # Skip to the newest request; the ones in between are already out of date
+        while True:
+            try:
+                request = requests.get_nowait()
+            except queue.Empty:
+                break
+        if request is None:
+            return
+        request_id, deck_path, seed, index, options, preview_size = request
+        started = time.perf_counter()
+        try:
+            options = render_options(seed, **options)
+            key = (tuple(deck_list(deck_path)), options['grain_range'] > 0) + \
+                tuple(options[name] for name in state_options)
+            if key != state_key:
+                for path in deck_list(deck_path):
+                    prepare_deck_atlas(path)
+                state = init_render_state(deck_path, dict(options, seed=preview_seed))
+                state_key, pool_seed = key, preview_seed
+            if 'background_pool' in state and pool_seed != seed:
+                state['background_pool'], pool_seed = seeded_background_pool(state['layout'].image_size, options), seed
+            state['sprite_cache'].set_size_variation(options['size_variation'])
+            state['options'] = options
+            image, annotations = render_preview(state, index, preview_size)
+        except Exception as e:
+            state = state_key = pool_seed = None
+            replies.put((request_id, None, None, str(e), 0))
+            continue
+        replies.put((request_id, (image.mode, image.size, image.tobytes()), annotations, None,
+                     time.perf_counter() - started))
+
+class PreviewServer:
+    def __init__(self):
+        self.requests = multiprocessing.Queue()
+        self.replies = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=preview_worker, args=(self.requests, self.replies), daemon=True)
+        self.process.start()
+        self.last_request = 0
+
+    def request(self, deck_path, options, seed=None, index=0, preview_size=None):
+        # Returns the request id; poll() hands back replies as they arrive
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.last_request += 1
+        self.requests.put((self.last_request, deck_path, seed, index, options, preview_size))
+        return self.last_request
+
+    def poll(self):
+        # The newest reply as (request_id, image, annotations, error, seconds), or None if nothing arrived
+        latest = None
+        while True:
+            try:
+                latest = self.replies.get_nowait()
+            except queue.Empty:
+                break
+        if latest is None:
+            return None
+        request_id, image_data, annotations, error, seconds = latest
+        image = Image.frombytes(*image_data) if image_data is not None else None
+        return request_id, image, annotations, error, seconds
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
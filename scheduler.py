@@ -0,0 +1,132 @@
+import math
+import os
+import threading
+
+# Sizing the worker pool for the machine it actually runs on. In a container os.cpu_count() reports
+# the host's CPUs, not the cgroup quota, and nothing stops N workers with full sprite caches from
+# outgrowing the memory limit. plan_pool turns a short calibration (seconds per image and the RSS of
+# a warmed-up worker) into a worker count, chunksize and, when memory is tight, a smaller sprite cache.
+
+memory_headroom = 0.9  # share of the cgroup memory limit used as the default ceiling
+target_chunk_seconds = 0.25  # work per chunk, enough to amortize IPC without starving the tail
+min_worker_seconds = 2.0  # a worker must have at least this much work to be worth starting
+
+def read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+def cgroup_cpu_limit():
+    # CPUs allowed by the cgroup quota (v2, then v1), or None when unlimited
+    line = read_first_line('/sys/fs/cgroup/cpu.max')
+    if line is not None:
+        quota, period = (line.split() + ['100000'])[:2]
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    quota = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota is not None and period is not None and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+def cgroup_memory_limit():
+    # Bytes allowed by the cgroup (v2, then v1), or None when unlimited
+    line = read_first_line('/sys/fs/cgroup/memory.max')
+    if line is None:
+        line = read_first_line('/sys/fs/cgroup/memory/memory.limit_in_bytes')
+    if line is None or line == 'max' or int(line) >= 2 ** 60:
+        return None
+    return int(line)
+
+def available_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+def memory_ceiling(memory_limit_mb=None):
+    # Bytes the whole run (parent and workers) should stay under, or None for no ceiling
+    if memory_limit_mb:
+        return int(memory_limit_mb * 1024 * 1024)
+    limit = cgroup_memory_limit()
+    return int(limit * memory_headroom) if limit is not None else None
+
+def process_rss(pid='self'):
+    # Resident set size in bytes from /proc, or None where there is no /proc
+    line = read_first_line(f'/proc/{pid}/statm')
+    if line is None:
+        return None
+    return int(line.split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def total_rss(pids):
+    sizes = [process_rss(pid) for pid in ['self', *pids]]
+    return sum(size for size in sizes if size is not None)
+
+def plan_pool(total_images, calibration, cpus, ceiling=None, workers=None, sprite_cache_mb=64, variant_cache_mb=0):
+    # calibration: seconds_per_image, rss and sprite_cache_bytes of one worker after a few images,
+    # plus queued_bytes, what its writer queue can hold, and variant_cache_bytes and variant_bytes,
+    # what its transformed variant tier holds and may grow to. Returns workers, chunksize,
+    # sprite_cache_mb, variant_cache_mb and per_worker (estimated peak RSS in bytes, None when RSS
+    # could not be measured).
+    seconds = max(calibration['seconds_per_image'], 1e-3)
+    if workers is None:
+        workers = min(cpus, max(1, int(total_images * seconds / min_worker_seconds)))
+
+    per_worker = None
+    if calibration['rss'] is not None:
+        cache_growth = max(0, sprite_cache_mb * 1024 * 1024 - calibration['sprite_cache_bytes'])
+        variant_growth = max(0, min(variant_cache_mb * 1024 * 1024, calibration['variant_bytes'])
+                             - calibration['variant_cache_bytes'])
+        per_worker = calibration['rss'] + cache_growth + variant_growth + calibration['queued_bytes']
+        if ceiling is not None:
+            room = ceiling - (process_rss() or 0)
+            workers = max(1, min(workers, room // per_worker))
+            if per_worker > room:
+                # Not even one worker fits with full caches: share what is left between both tiers,
+                # in proportion to how much each still had to grow
+                base = per_worker - cache_growth - variant_growth
+                fraction = max(0, room - base) / max(1, cache_growth + variant_growth)
+                sprite_cache_mb = min(sprite_cache_mb, int(calibration['sprite_cache_bytes'] + cache_growth * fraction)
+                                      // (1024 * 1024))
+                variant_cache_mb = min(variant_cache_mb, int(calibration['variant_cache_bytes'] + variant_growth * fraction)
+                                       // (1024 * 1024))
+                cache_growth = max(0, sprite_cache_mb * 1024 * 1024 - calibration['sprite_cache_bytes'])
+                variant_growth = max(0, variant_cache_mb * 1024 * 1024 - calibration['variant_cache_bytes'])
+                per_worker = base + cache_growth + variant_growth
+
+    per_worker_images = math.ceil(total_images / workers)
+    chunksize = max(1, min(round(target_chunk_seconds / seconds), per_worker_images // 4))
+    return {'workers': workers, 'chunksize': chunksize, 'sprite_cache_mb': sprite_cache_mb,
+            'variant_cache_mb': variant_cache_mb, 'per_worker': per_worker}
+
+class TaskWindow:
+    # Feeds tasks to Pool.imap_unordered but lets at most `size` be outstanding: the pool's feeder
+    # thread blocks here until the main loop calls release() for a finished task. When workers stall
+    # on a full writer queue, results stop, releases stop, and no more tasks are queued.
+    def __init__(self, tasks, size):
+        self.tasks = tasks
+        self.slots = threading.Semaphore(max(1, size))
+        self.closed = False
+
+    def __iter__(self):
+        for task in self.tasks:
+            # Time out now and then so close() can free the feeder thread when the pool shuts down
+            while not self.slots.acquire(timeout=0.1):
+                if self.closed:
+                    return
+            if self.closed:
+                return
+            yield task
+
+    def release(self):
+        self.slots.release()
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,105 @@
+import io
+import json
+import os
+import tarfile
+import threading
+
+from output_writer import write_file
+
+shard_index_name = 'index.json'
+
+class TarShardSink:
+    # Streams samples into tar shards of shard_size samples per split, WebDataset style: each sample
+    # is a <key>.<ext> image and a <key>.txt YOLO label next to each other. Every worker writes its own
+    # shards, named <split>-<prefix>-<n>.tar; an open shard is kept as .tar.tmp and renamed once it is
+    # full or the worker finishes, so only complete archives are ever visible.
+    def __init__(self, shards_dir, shard_size, prefix):
+        self.shards_dir = shards_dir
+        self.shard_size = max(1, shard_size)
+        self.prefix = prefix
+        self.open_shards = {}  # split -> [tarfile, path, sample count]
+        self.shard_counts = {}
+        self.lock = threading.Lock()
+
+    def write(self, split, key, extension, image_data, label):
+        with self.lock:
+            shard = self.open_shards.get(split)
+            if shard is None:
+                shard = self._open_shard(split)
+            add_member(shard[0], f'{key}.{extension}', image_data)
+            add_member(shard[0], f'{key}.txt', label.encode())
+            shard[2] += 1
+            if shard[2] >= self.shard_size:
+                self._close_shard(split)
+
+    def close(self):
+        with self.lock:
+            for split in list(self.open_shards):
+                self._close_shard(split)
+
+    def _open_shard(self, split):
+        number = self.shard_counts.get(split, 0)
+        self.shard_counts[split] = number + 1
+        path = os.path.join(self.shards_dir, f'{split}-{self.prefix}-{number:06d}.tar')
+        shard = [tarfile.open(path + '.tmp', 'w', format=tarfile.USTAR_FORMAT), path, 0]
+        self.open_shards[split] = shard
+        return shard
+
+    def _close_shard(self, split):
+        archive, path, _ = self.open_shards.pop(split)
+        archive.close()
+        os.replace(path + '.tmp', path)
+
+def add_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+def shard_split(shard_name):
+    return shard_name.split('-', 1)[0]
+
+def write_shard_index(shards_dir):
+    # index.json lists every shard per split with the sample keys it holds, read back from the tar
+    # headers so shards written by several machines can be indexed in one place
+    index = {}
+    for shard_name in sorted(os.listdir(shards_dir)):
+        if not shard_name.endswith('.tar'):
+            continue
+        with tarfile.open(os.path.join(shards_dir, shard_name)) as archive:
+            keys = sorted({os.path.splitext(name)[0] for name in archive.getnames()})
+        index.setdefault(shard_split(shard_name), []).append({'shard': shard_name, 'count': len(keys), 'keys': keys})
+    write_file(os.path.join(shards_dir, shard_index_name), json.dumps(index, indent=1))
+    return index
+
+def load_shard_index(shards_dir):
+    index_path = os.path.join(shards_dir, shard_index_name)
+    if not os.path.exists(index_path):
+        return write_shard_index(shards_dir)
+    with open(index_path) as f:
+        return json.load(f)
+
+def expand_shards(dataset_dir, output_dir=None):
+    # Unpacks <dataset_dir>/shards into the <split>/images and <split>/labels layout Ultralytics reads
+    output_dir = output_dir or dataset_dir
+    shards_dir = os.path.join(dataset_dir, 'shards')
+    if not os.path.isdir(shards_dir):
+        print(f"Error: no shards directory in {dataset_dir}, only datasets generated with --output-mode tar can be expanded")
+        return None
+    index = load_shard_index(shards_dir)
+    expanded = 0
+    for split, shards in index.items():
+        os.makedirs(os.path.join(output_dir, split, 'images'), exist_ok=True)
+        os.makedirs(os.path.join(output_dir, split, 'labels'), exist_ok=True)
+        for shard in shards:
+            with tarfile.open(os.path.join(shards_dir, shard['shard'])) as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    name = os.path.basename(member.name)
+                    subdir = 'labels' if name.endswith('.txt') else 'images'
+                    write_file(os.path.join(output_dir, split, subdir, name), archive.extractfile(member).read())
+                    expanded += name.endswith('.txt')
+    if output_dir != dataset_dir and os.path.exists(os.path.join(dataset_dir, 'data.yaml')):
+        with open(os.path.join(dataset_dir, 'data.yaml')) as f:
+            write_file(os.path.join(output_dir, 'data.yaml'), f.read())
+    return expanded
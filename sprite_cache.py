@@ -0,0 +1,129 @@
+import math
+from collections import OrderedDict
+from PIL import Image
+
+from sprite_transforms import transform_sprite, transformed_corners
+
+scale_modes = ['exact', 'bucketed']
+
+class SpriteCache:
+    # Resampled sprites keyed by (asset, scale key), evicted least recently used once the decoded
+    # size passes max_bytes. 'exact' keys on the final pixel size so output matches an uncached
+    # resize; 'bucketed' snaps the scale to one of `buckets` steps across the size variation range
+    # so the cache stays small and hits almost every time. base_scale is the canvas scale every
+    # sprite is multiplied by, so buckets still span the variation range on smaller canvases.
+    #
+    # Full size transformed variants live in a tier of their own, an LRU of variant_bytes on top of
+    # max_bytes. Sharing one LRU, the stream of scaled sprites kept evicting the variants, so every
+    # sprite paid for a bicubic warp again and quantized transforms were no faster than exact ones.
+    def __init__(self, max_bytes, mode='exact', buckets=16, size_variation=0, base_scale=1.0, variant_bytes=0):
+        if mode not in scale_modes:
+            raise ValueError(f"Unknown sprite scale mode '{mode}', expected one of {scale_modes}")
+        self.max_bytes = max_bytes
+        self.variant_bytes = variant_bytes
+        self.mode = mode
+        self.buckets = max(1, buckets)
+        self.size_variation = size_variation
+        self.base_scale = base_scale
+        self.tiers = {'sprites': OrderedDict(), 'variants': OrderedDict()}
+        self.tier_bytes = {'sprites': 0, 'variants': 0}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_size_variation(self, size_variation):
+        # Bucketed keys are bucket numbers within the variation range, so a new range makes the scaled
+        # sprites stale; transformed variants are full size and stay
+        if size_variation != self.size_variation and self.mode == 'bucketed':
+            self.tiers['sprites'].clear()
+            self.tier_bytes['sprites'] = 0
+        self.size_variation = size_variation
+
+    def quantize(self, scale):
+        if self.size_variation <= 0:
+            return 0, 1.0
+        low = 1 - self.size_variation
+        step = 2 * self.size_variation / self.buckets
+        bucket = min(self.buckets - 1, max(0, int((scale - low) / step)))
+        return bucket, low + (bucket + 0.5) * step
+
+    def resize(self, asset_key, image, scale, prepare=None, transform=None):
+        # prepare turns the resampled image into whatever the render backend composites with
+        # (e.g. premultiplied arrays), so that conversion is cached along with the resize.
+        # transform is a quantized (angle, skew_x, skew_y). The transformed variant of the full
+        # size asset is cached on its own, a pre-rotated atlas filled on demand, and then scaled
+        # like any other asset, so the expensive bicubic transform runs once per variant.
+        if transform is not None:
+            source = image
+            tier = 'variants' if self.variant_bytes > 0 else 'sprites'
+            image = self._lookup((asset_key, transform), lambda: transform_sprite(source, *transform), tier)
+
+        if self.mode == 'bucketed':
+            scale_key, scale = self.quantize(scale / self.base_scale)
+            scale *= self.base_scale
+        size = (int(image.width * scale), int(image.height * scale))
+        if self.mode == 'exact':
+            scale_key = size
+
+        def build():
+            sprite = image.resize(size, Image.LANCZOS)
+            return prepare(sprite) if prepare is not None else sprite
+
+        return self._lookup((asset_key, scale_key, transform), build)
+
+    @property
+    def current_bytes(self):
+        return self.tier_bytes['sprites'] + self.tier_bytes['variants']
+
+    def _lookup(self, key, build, tier='sprites'):
+        max_bytes = self.variant_bytes if tier == 'variants' else self.max_bytes
+        if max_bytes <= 0:
+            return build()
+
+        sprites = self.tiers[tier]
+        sprite = sprites.get(key)
+        if sprite is not None:
+            sprites.move_to_end(key)
+            self.hits += 1
+            return sprite
+
+        self.misses += 1
+        sprite = build()
+        sprites[key] = sprite
+        self.tier_bytes[tier] += sprite_nbytes(sprite)
+        while self.tier_bytes[tier] > max_bytes and len(sprites) > 1:
+            _, evicted = sprites.popitem(last=False)
+            self.tier_bytes[tier] -= sprite_nbytes(evicted)
+            self.evictions += 1
+        return sprite
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': sum(len(sprites) for sprites in self.tiers.values()), 'bytes': self.current_bytes}
+
+def resample_sprite(image, size, transform=None):
+    sprite = image.resize(size, Image.LANCZOS)
+    if transform is not None:
+        sprite = transform_sprite(sprite, *transform)
+    return sprite
+
+def variant_nbytes(sizes, transforms):
+    # Bytes for every transformed variant of assets with the given sizes, RGBA at full size. An
+    # upper bound, since each variant is cropped to its alpha bounds.
+    total = 0
+    for size in sizes:
+        for transform in transforms:
+            corners = transformed_corners(size, *transform)
+            xs, ys = [x for x, _ in corners], [y for _, y in corners]
+            total += (math.ceil(max(xs)) - math.floor(min(xs)) + 1) * (math.ceil(max(ys)) - math.floor(min(ys)) + 1) * 4
+    return total
+
+def sprite_nbytes(sprite):
+    nbytes = getattr(sprite, 'nbytes', None)
+    if nbytes is None:
+        nbytes = sprite.width * sprite.height * len(sprite.getbands())
+    return nbytes
+
+def hit_rate(stats):
+    lookups = stats['hits'] + stats['misses']
+    return stats['hits'] / lookups if lookups else 0.0
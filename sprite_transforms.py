@@ -0,0 +1,72 @@
+import math
+import numpy as np
+from PIL import Image
+
+# Rotation and perspective skew for sprites. A transformed sprite is cropped to its alpha bounds, so
+# the sprite rectangle is the tight box of what is actually drawn and the layout and label math keep
+# working on width/height as they do for upright sprites.
+#
+# 'quantized' snaps angles and skews to steps so transformed sprites can be cached and reused like
+# resized ones; 'exact' transforms every sprite with the drawn values and bypasses the cache.
+transform_modes = ['quantized', 'exact']
+
+def random_transform(rng, rotation_range, skew_range):
+    # Skew tilts along one random axis at a time, which keeps the number of quantized variants
+    # linear in the skew steps. Always the same three draws whichever ranges are set.
+    angle = rng.uniform(-rotation_range, rotation_range)
+    horizontal = rng.random() < 0.5
+    skew = rng.uniform(-skew_range, skew_range)
+    return (angle, skew, 0.0) if horizontal else (angle, 0.0, skew)
+
+def quantize(value, step):
+    return round(value / step) * step if step > 0 else value
+
+def quantize_transform(angle, skew_x, skew_y, angle_step, skew_step):
+    return quantize(angle, angle_step), quantize(skew_x, skew_step), quantize(skew_y, skew_step)
+
+def quantized_transforms(rotation_range, skew_range, angle_step, skew_step):
+    # Every transform quantize_transform can return for draws from random_transform
+    def steps(limit, step):
+        count = round(limit / step) if step > 0 else 0
+        return [quantize(i * step, step) for i in range(-count, count + 1)]
+    angles = steps(rotation_range, angle_step)
+    skews = steps(skew_range, skew_step)
+    return {(angle, skew, 0.0) for angle in angles for skew in skews} | \
+        {(angle, 0.0, skew) for angle in angles for skew in skews}
+
+def transformed_corners(size, angle, skew_x, skew_y):
+    # Skew pulls one edge in, like tilting the sprite away from the camera: skew_x > 0 narrows the
+    # top edge, skew_y > 0 shortens the left edge. Rotation is counter-clockwise like Image.rotate.
+    width, height = size
+    top, bottom = max(skew_x, 0) * width / 2, max(-skew_x, 0) * width / 2
+    left, right = max(skew_y, 0) * height / 2, max(-skew_y, 0) * height / 2
+    corners = [(top, left), (width - top, right), (width - bottom, height - right), (bottom, height - left)]
+
+    cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    cx, cy = width / 2, height / 2
+    return [(cx + (x - cx) * cos + (y - cy) * sin, cy - (x - cx) * sin + (y - cy) * cos) for x, y in corners]
+
+def perspective_coefficients(source, target):
+    # Image.transform maps each output pixel back to the input, so solve for target -> source
+    rows, values = [], []
+    for (sx, sy), (tx, ty) in zip(source, target):
+        rows.append([tx, ty, 1, 0, 0, 0, -sx * tx, -sx * ty])
+        rows.append([0, 0, 0, tx, ty, 1, -sy * tx, -sy * ty])
+        values.extend((sx, sy))
+    return np.linalg.solve(np.array(rows, dtype=np.float64), np.array(values, dtype=np.float64)).tolist()
+
+def transform_sprite(image, angle, skew_x=0, skew_y=0):
+    if not angle and not skew_x and not skew_y:
+        return image
+    corners = transformed_corners(image.size, angle, skew_x, skew_y)
+    min_x = math.floor(min(x for x, _ in corners))
+    min_y = math.floor(min(y for _, y in corners))
+    size = (math.ceil(max(x for x, _ in corners)) - min_x + 1, math.ceil(max(y for _, y in corners)) - min_y + 1)
+    source = [(0, 0), (image.width, 0), (image.width, image.height), (0, image.height)]
+    target = [(x - min_x, y - min_y) for x, y in corners]
+    # One bicubic resample for rotation and skew together, premultiplied so transparent pixels do
+    # not bleed their color into the edges
+    transformed = image.convert('RGBa').transform(size, Image.PERSPECTIVE, perspective_coefficients(source, target),
+                                                  Image.BICUBIC).convert('RGBA')
+    bbox = transformed.getbbox()
+    return transformed.crop(bbox) if bbox else transformed
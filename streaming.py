@@ -0,0 +1,160 @@
+import os
+import random
+from collections import deque
+from multiprocessing import Pool
+import numpy as np
+
+from factory_helpers import check_render_options, deck_list, init_render_state, load_deck_assets, prepare_deck_atlas, render_task_image
+
+# Training straight from the renderer: samples come out as (HxWx3 uint8 array, Nx5 float32 YOLO label
+# array) with no encoding and no files. Sample (split, index) is the same image generate_dataset writes
+# as <split>_<index> for the same seed and options, so a stream can be swapped for a dataset on disk.
+#
+# SyntheticDataset is map-style and renders in the calling process, which suits frameworks that run
+# their own loader workers. SyntheticStream renders ahead in a pool of worker processes and keeps at
+# most prefetch samples in flight, so a slow training loop holds back the workers instead of memory.
+
+# Same defaults as the command line
+render_option_defaults = {
+    'brightness_range': 0.4,
+    'grain_range': 0,
+    'grain_style': 'gaussian',
+    'grain_bank_size': 4,
+    'size_variation': 0.25,
+    'rotation_range': 0,
+    'skew_range': 0,
+    'transform_mode': 'quantized',
+    'angle_step': 2,
+    'skew_step': 0.1,
+    'include_active_players': True,
+    'include_seated_players': True,
+    'include_dealer_button': True,
+    'selected_model': 'yolov8',
+    'background_pool_size': 0,
+    'background_color_shift': 0,
+    'sprite_cache_mb': 64,
+    'variant_cache_mb': 256,
+    'sprite_scale_mode': 'exact',
+    'sprite_scale_buckets': 16,
+    'render_backend': 'pil',
+    'deck_weights': None,
+    'image_size': (1024, 768),
+    'layout': 'row',
+    'seat_map': 'six_max',
+}
+
+_stream_state = {}
+
+def render_options(seed=None, **overrides):
+    unknown = set(overrides) - set(render_option_defaults)
+    if unknown:
+        raise TypeError(f"Unknown render options: {', '.join(sorted(unknown))}")
+    options = dict(render_option_defaults, **overrides)
+    options['seed'] = seed if seed is not None else random.randrange(2 ** 32)
+    return options
+
+def annotation_array(annotations):
+    # class, center x, center y, width, height per row, normalized like the label files
+    return np.array(annotations, dtype=np.float32).reshape(-1, 5)
+
+def render_sample(state, split, index):
+    image, annotations = render_task_image(state, split, index)
+    return np.asarray(image.convert('RGB')), annotation_array(annotations)
+
+def prepare_deck(deck_path, options):
+    # Everything init_stream_worker loads or checks, done here first: a Pool respawns a failing
+    # initializer forever, so a bad deck or option would hang the stream instead of raising
+    check_render_options(options)
+    for path in deck_list(deck_path):
+        prepare_deck_atlas(path)
+        unknown = load_deck_assets(path, options)  # raises FileNotFoundError for a missing asset
+        if unknown:
+            raise ValueError(f"{path} has cards outside the class map: {', '.join(sorted(unknown))}")
+
+def init_stream_worker(deck_path, options):
+    _stream_state.update(init_render_state(deck_path, options))
+
+def render_stream_sample(task):
+    return render_sample(_stream_state, *task)
+
+class SyntheticDataset:
+    def __init__(self, deck_path, num_images, split='train', seed=None, **options):
+        self.options = render_options(seed, **options)
+        prepare_deck(deck_path, self.options)
+        self.deck_path = deck_path
+        self.num_images = num_images
+        self.split = split
+        self.seed = self.options['seed']
+        self._state = None
+
+    def __len__(self):
+        return self.num_images
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.num_images:
+            raise IndexError(f"Sample {index} out of range for {self.num_images} images")
+        if self._state is None:
+            self._state = init_render_state(self.deck_path, self.options)
+        return render_sample(self._state, self.split, index)
+
+    def __getstate__(self):
+        # Loader workers build their own backend and caches instead of receiving a pickled copy
+        state = self.__dict__.copy()
+        state['_state'] = None
+        return state
+
+class SyntheticStream:
+    # num_images=None streams forever. Samples arrive in index order whatever the number of workers.
+    def __init__(self, deck_path, num_images=None, split='train', seed=None, workers=None, prefetch=None,
+                 start=0, **options):
+        self.options = render_options(seed, **options)
+        prepare_deck(deck_path, self.options)
+        self.deck_path = deck_path
+        self.num_images = num_images
+        self.split = split
+        self.seed = self.options['seed']
+        self.workers = workers
+        self.prefetch = prefetch
+        self.start = start
+        self.pool = None
+
+    def __len__(self):
+        if self.num_images is None:
+            raise TypeError("An endless stream has no length")
+        return self.num_images
+
+    def __iter__(self):
+        self.close()
+        workers = self.workers or os.cpu_count()
+        self.pool = Pool(workers, initializer=init_stream_worker, initargs=(self.deck_path, self.options))
+        prefetch = max(1, self.prefetch or 2 * workers)
+        stop = None if self.num_images is None else self.start + self.num_images
+        index = self.start
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < prefetch and (stop is None or index < stop):
+                    pending.append(self.pool.apply_async(render_stream_sample, ((self.split, index),)))
+                    index += 1
+                if not pending:
+                    break
+                yield pending.popleft().get()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def stream_samples(deck_path, num_images=None, split='train', seed=None, workers=None, prefetch=None, **options):
+    # Generator form of SyntheticStream
+    with SyntheticStream(deck_path, num_images, split, seed, workers, prefetch, **options) as stream:
+        yield from stream
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+class _StageTimer:
+    __slots__ = ('telemetry', 'name', 'start')
+
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.telemetry.add_time(self.name, time.perf_counter() - self.start)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+_null_timer = _NullTimer()
+
+class Telemetry:
+    # Per-process counters, stage timers and per-image latencies. Render code wraps each stage in
+    # `with telemetry.stage(name)`; a disabled instance hands out a shared no-op timer so the
+    # instrumentation costs next to nothing when it is off. Writer threads record into the same
+    # instance, hence the lock.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.time()
+        self.cpu_started = time.process_time()
+        self.timers = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.latencies = array('d')
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _null_timer
+        return _StageTimer(self, name)
+
+    def add_time(self, name, seconds):
+        if self.enabled:
+            with self.lock:
+                self.timers[name] += seconds
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    def record_image(self, latency):
+        if self.enabled:
+            with self.lock:
+                self.latencies.append(latency)
+                self.counters['images'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'started': self.started,
+                'finished': time.time(),
+                'cpu_seconds': time.process_time() - self.cpu_started,
+                'timers': dict(self.timers),
+                'counters': dict(self.counters),
+                'latencies': list(self.latencies),
+            }
+
+    def dump(self, directory):
+        with open(os.path.join(directory, f'worker-{os.getpid()}.json'), 'w') as f:
+            json.dump(self.snapshot(), f)
+
+null_telemetry = Telemetry(enabled=False)
+
+# Stages in pipeline order, used to order the summary table
+stage_names = ['asset_load', 'background', 'filter', 'composite', 'grain', 'encode', 'write']
+# Stages grouped by the part of the pipeline that runs them: render is CPU work in the worker,
+# encode is CPU work in the writer threads and write is file I/O
+stage_groups = {'render': ['asset_load', 'background', 'filter', 'composite', 'grain'],
+                'encode': ['encode'], 'write': ['write']}
+# Below this CPU time per second of worker wall time, a worker spends most of its time waiting
+cpu_bound_ratio = 0.75
+
+def load_worker_snapshots(directory):
+    snapshots = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith('worker-') and filename.endswith('.json'):
+            with open(os.path.join(directory, filename)) as f:
+                snapshots.append(json.load(f))
+    return snapshots
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def build_run_report(snapshots, wall_seconds, extra=None):
+    latencies = sorted(latency for snapshot in snapshots for latency in snapshot['latencies'])
+    timers = defaultdict(float)
+    counters = defaultdict(int)
+    workers = []
+    for snapshot in snapshots:
+        for name, seconds in snapshot['timers'].items():
+            timers[name] += seconds
+        for name, value in snapshot['counters'].items():
+            counters[name] += value
+        images = snapshot['counters'].get('images', 0)
+        active_seconds = max(snapshot['finished'] - snapshot['started'], 1e-9)
+        workers.append({'pid': snapshot['pid'], 'images': images, 'images_per_sec': images / active_seconds,
+                        'active_seconds': active_seconds, 'cpu_seconds': snapshot['cpu_seconds'],
+                        'cpu_ratio': snapshot['cpu_seconds'] / active_seconds,
+                        'bytes_written': snapshot['counters'].get('bytes_written', 0)})
+
+    images = counters.get('images', 0)
+    stage_seconds = sum(timers.get(name, 0.0) for name in stage_names)
+    active_seconds = sum(worker['active_seconds'] for worker in workers)
+    report = {
+        'wall_seconds': wall_seconds,
+        'images': images,
+        'images_per_sec': images / wall_seconds if wall_seconds else 0.0,
+        'bytes_written': counters.get('bytes_written', 0),
+        'latency_ms': {'p50': percentile(latencies, 0.5) * 1000, 'p95': percentile(latencies, 0.95) * 1000,
+                       'max': (latencies[-1] if latencies else 0.0) * 1000},
+        'stages': {name: {'seconds': timers[name], 'ms_per_image': timers[name] * 1000 / images if images else 0.0,
+                          'share': timers[name] / stage_seconds if stage_seconds else 0.0}
+                   for name in stage_names if name in timers},
+        'stage_group_shares': {group: sum(timers.get(name, 0.0) for name in names) / stage_seconds
+                                              if stage_seconds else 0.0
+                               for group, names in stage_groups.items()},
+        'cpu_ratio': sum(worker['cpu_seconds'] for worker in workers) / active_seconds if active_seconds else 0.0,
+        'queue_wait_seconds': {'render_blocked_on_writer': timers.get('queue_put_wait', 0.0),
+                               'writer_idle': timers.get('queue_get_wait', 0.0)},
+        'counters': dict(counters),
+        'workers': workers,
+    }
+    if extra:
+        report.update(extra)
+    return report
+
+def format_run_report(report):
+    lines = [
+        f"{report['images']} images in {report['wall_seconds']:.1f}s ({report['images_per_sec']:.1f} img/s), "
+        f"{report['bytes_written'] / 1024 / 1024:.1f} MiB written",
+        f"Per-image latency: p50 {report['latency_ms']['p50']:.1f} ms, p95 {report['latency_ms']['p95']:.1f} ms, "
+        f"max {report['latency_ms']['max']:.1f} ms",
+        "",
+        f"{'stage':<12}{'total s':>10}{'ms/image':>10}{'share':>8}",
+    ]
+    for name, stage in report['stages'].items():
+        lines.append(f"{name:<12}{stage['seconds']:>10.2f}{stage['ms_per_image']:>10.2f}{stage['share']:>8.1%}")
+    waits = report['queue_wait_seconds']
+    lines.append("")
+    lines.append(f"Render blocked on writer queue: {waits['render_blocked_on_writer']:.2f}s, "
+                 f"writer threads idle: {waits['writer_idle']:.2f}s")
+    lines.append(bottleneck_verdict(report))
+    lines.append("")
+    lines.append(f"{'worker':<10}{'images':>8}{'img/s':>8}{'CPU s':>8}{'CPU/wall':>10}")
+    for worker in report['workers']:
+        lines.append(f"{worker['pid']:<10}{worker['images']:>8}{worker['images_per_sec']:>8.1f}"
+                     f"{worker['cpu_seconds']:>8.1f}{worker['cpu_ratio']:>10.0%}")
+    return "\n".join(lines)
+
+def bottleneck_verdict(report):
+    # The stage group with the largest share of stage time is the bottleneck. Encoding runs in the
+    # writer threads but is CPU work, so it only counts as I/O together with a low CPU/wall ratio.
+    # Queue waits only say which side waits on the other, not why.
+    shares = report['stage_group_shares']
+    group = max(shares, key=shares.get)
+    share = f"{shares[group]:.0%} of stage time"
+    cpu = f"workers used {report['cpu_ratio']:.0%} of their wall time on the CPU"
+    if group == 'write' or report['cpu_ratio'] < cpu_bound_ratio and shares['write'] >= shares['encode']:
+        return f"File writes are the bottleneck (I/O bound): write takes {shares['write']:.0%} of stage time, {cpu}"
+    if report['cpu_ratio'] < cpu_bound_ratio:
+        return f"Workers are mostly waiting ({cpu}); {group} takes {share}"
+    if group == 'encode':
+        return f"Encoding is the bottleneck (CPU bound, writer threads): {share}, {cpu}"
+    return f"Rendering is the bottleneck (CPU bound): {share}, {cpu}"
@@ -0,0 +1,295 @@
+import json
+import os
+import tarfile
+from multiprocessing import Pool
+import numpy as np
+import yaml
+from PIL import Image
+from tqdm import tqdm
+
+from factory_helpers import card_names
+from shards import load_shard_index
+
+# Scans a generated dataset, either the <split>/images + <split>/labels layout or shards/, and reports
+# class counts, box histograms and problems: missing or orphan image/label pairs, malformed labels,
+# unknown classes, boxes outside the canvas and overlapping boxes. Labels are parsed in batches by a
+# pool of workers that each return a small mergeable summary; images are only opened with
+# check_images. Missing/orphan pairs come from directory listings, so they cost no file reads.
+
+histogram_bins = 20  # over normalized 0..1 coordinates
+max_examples = 20  # sample keys kept per issue
+files_per_task = 1000
+bounds_tolerance = 1e-6
+
+# Issues that fail validation; overlaps only fail with fail_on_overlap
+error_issues = ['missing_labels', 'orphan_labels', 'malformed_labels', 'empty_labels', 'unknown_classes',
+                'out_of_bounds', 'corrupt_images']
+
+def empty_summary(num_classes):
+    return {
+        'images': 0,
+        'labels': 0,
+        'objects': 0,
+        'classes': np.zeros(num_classes, np.int64),
+        'histograms': {name: np.zeros(histogram_bins, np.int64) for name in ('width', 'height', 'center_x', 'center_y')},
+        'objects_per_image': np.zeros(0, np.int64),
+        'issues': {},
+    }
+
+def add_issue(summary, issue, key, count=1):
+    entry = summary['issues'].setdefault(issue, {'count': 0, 'examples': []})
+    entry['count'] += count
+    if len(entry['examples']) < max_examples:
+        entry['examples'].append(key)
+
+def merge_counts(total, part):
+    if len(part) > len(total):
+        total, part = part.copy(), total
+    total[:len(part)] += part
+    return total
+
+def merge_summary(total, part):
+    for name in ('images', 'labels', 'objects'):
+        total[name] += part[name]
+    total['classes'] += part['classes']
+    for name, counts in part['histograms'].items():
+        total['histograms'][name] += counts
+    total['objects_per_image'] = merge_counts(total['objects_per_image'], part['objects_per_image'])
+    for issue, entry in part['issues'].items():
+        merged = total['issues'].setdefault(issue, {'count': 0, 'examples': []})
+        merged['count'] += entry['count']
+        merged['examples'].extend(entry['examples'][:max_examples - len(merged['examples'])])
+
+def histogram(values):
+    bins = np.clip((values * histogram_bins).astype(np.int64), 0, histogram_bins - 1)
+    return np.bincount(bins, minlength=histogram_bins)
+
+def parse_label(text):
+    # Five values per row as one flat list, or None if any line does not hold exactly five numbers
+    lines = [line for line in text.splitlines() if line.strip()]
+    values = text.split()
+    if len(values) != 5 * len(lines):
+        return None
+    try:
+        return [float(value) for value in values]
+    except ValueError:
+        return None
+
+def overlap_counts(boxes, owner, counts, overlap_iou):
+    # Box pairs per image whose intersection over union exceeds overlap_iou. Images are padded to
+    # the largest box count so a whole batch is compared in one go.
+    slots = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    corners = np.zeros((len(counts), counts.max(), 4))
+    corners[owner, slots] = np.stack([boxes[:, 1] - boxes[:, 3] / 2, boxes[:, 2] - boxes[:, 4] / 2,
+                                      boxes[:, 1] + boxes[:, 3] / 2, boxes[:, 2] + boxes[:, 4] / 2], axis=1)
+    left, top, right, bottom = (corners[..., i] for i in range(4))
+    width = np.clip(np.minimum(right[:, :, None], right[:, None]) - np.maximum(left[:, :, None], left[:, None]), 0, None)
+    height = np.clip(np.minimum(bottom[:, :, None], bottom[:, None]) - np.maximum(top[:, :, None], top[:, None]), 0, None)
+    intersection = width * height
+    area = (right - left) * (bottom - top)
+    union = area[:, :, None] + area[:, None] - intersection
+    overlapping = intersection > overlap_iou * np.maximum(union, 1e-12)
+    return np.triu(overlapping, 1).sum(axis=(1, 2))
+
+def scan_labels(summary, keys, texts, num_classes, overlap_iou):
+    # Parses a batch of label files and folds them into summary with whole-batch array operations
+    summary['labels'] += len(keys)
+    parsed_keys, rows, counts = [], [], []
+    for key, text in zip(keys, texts):
+        values = parse_label(text)
+        if values is None:
+            add_issue(summary, 'malformed_labels', key)
+        elif not values:
+            add_issue(summary, 'empty_labels', key)
+        else:
+            parsed_keys.append(key)
+            rows.extend(values)
+            counts.append(len(values) // 5)
+    if not parsed_keys:
+        return
+    boxes = np.array(rows, np.float64).reshape(-1, 5)
+    counts = np.array(counts, np.int64)
+    owner = np.repeat(np.arange(len(counts)), counts)
+
+    def report(issue, per_image):
+        for image in np.flatnonzero(per_image):
+            add_issue(summary, issue, parsed_keys[image], int(per_image[image]))
+
+    classes = boxes[:, 0].astype(np.int64)
+    known = (classes == boxes[:, 0]) & (classes >= 0) & (classes < num_classes)
+    report('unknown_classes', np.bincount(owner[~known], minlength=len(counts)))
+    summary['objects'] += len(boxes)
+    summary['classes'] += np.bincount(classes[known], minlength=num_classes)
+    histograms = summary['histograms']
+    histograms['width'] += histogram(boxes[:, 3])
+    histograms['height'] += histogram(boxes[:, 4])
+    histograms['center_x'] += histogram(boxes[:, 1])
+    histograms['center_y'] += histogram(boxes[:, 2])
+    summary['objects_per_image'] = merge_counts(summary['objects_per_image'], np.bincount(counts))
+
+    outside = (boxes[:, 1] - boxes[:, 3] / 2 < -bounds_tolerance) | (boxes[:, 1] + boxes[:, 3] / 2 > 1 + bounds_tolerance) | \
+              (boxes[:, 2] - boxes[:, 4] / 2 < -bounds_tolerance) | (boxes[:, 2] + boxes[:, 4] / 2 > 1 + bounds_tolerance) | \
+              (boxes[:, 3] <= 0) | (boxes[:, 4] <= 0)
+    report('out_of_bounds', np.bincount(owner[outside], minlength=len(counts)))
+    report('overlaps', overlap_counts(boxes, owner, counts, overlap_iou))
+
+def check_image(summary, key, source):
+    try:
+        with Image.open(source) as image:
+            image.verify()
+    except Exception:
+        add_issue(summary, 'corrupt_images', key)
+
+def scan_files(task):
+    # One batch of the directory layout: label keys to parse, image files to verify if asked
+    split_dir, keys, image_names, num_classes, overlap_iou = task
+    summary = empty_summary(num_classes)
+    texts = []
+    for key in keys:
+        with open(os.path.join(split_dir, 'labels', f'{key}.txt')) as f:
+            texts.append(f.read())
+    scan_labels(summary, keys, texts, num_classes, overlap_iou)
+    for name in image_names:
+        summary['images'] += 1
+        check_image(summary, os.path.splitext(name)[0], os.path.join(split_dir, 'images', name))
+    return summary
+
+def scan_shard(task):
+    # A tar shard is read front to back; image members are skipped over unless they are verified
+    shard_path, num_classes, overlap_iou, check_images = task
+    summary = empty_summary(num_classes)
+    images, labels, texts = set(), [], []
+    with tarfile.open(shard_path) as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            key, extension = os.path.splitext(os.path.basename(member.name))
+            if extension == '.txt':
+                labels.append(key)
+                texts.append(archive.extractfile(member).read().decode())
+            else:
+                images.add(key)
+                summary['images'] += 1
+                if check_images:
+                    check_image(summary, key, archive.extractfile(member))
+    scan_labels(summary, labels, texts, num_classes, overlap_iou)
+    for key in sorted(images - set(labels)):
+        add_issue(summary, 'missing_labels', key)
+    for key in sorted(set(labels) - images):
+        add_issue(summary, 'orphan_labels', key)
+    return summary
+
+def list_stems(directory, suffix=None):
+    # file stem -> file name, ignoring the .tmp files of interrupted writes
+    stems = {}
+    if os.path.isdir(directory):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                stem, extension = os.path.splitext(entry.name)
+                if extension != '.tmp' and (suffix is None or extension == suffix):
+                    stems[stem] = entry.name
+    return stems
+
+def file_tasks(dataset_dir, split, summary, num_classes, overlap_iou, check_images):
+    split_dir = os.path.join(dataset_dir, split)
+    images = list_stems(os.path.join(split_dir, 'images'))
+    labels = list_stems(os.path.join(split_dir, 'labels'), '.txt')
+    for key in sorted(images.keys() - labels.keys()):
+        add_issue(summary, 'missing_labels', key)
+    for key in sorted(labels.keys() - images.keys()):
+        add_issue(summary, 'orphan_labels', key)
+    keys = sorted(labels)
+    image_names = sorted(images.values())
+    if not check_images:
+        summary['images'] += len(image_names)
+        image_names = []
+    tasks = []
+    for start in range(0, max(len(keys), len(image_names)), files_per_task):
+        tasks.append((split_dir, keys[start:start + files_per_task], image_names[start:start + files_per_task],
+                      num_classes, overlap_iou))
+    return tasks
+
+def dataset_class_names(dataset_dir):
+    # Class names from data.yaml, or the generator's classes when there is none
+    try:
+        with open(os.path.join(dataset_dir, 'data.yaml')) as f:
+            return list(yaml.safe_load(f)['names'])
+    except (OSError, KeyError, TypeError):
+        return card_names + ['PlayerSeated', 'PlayerActive', 'DealerButton']
+
+def summary_report(summary, class_names):
+    report = {name: summary[name] for name in ('images', 'labels', 'objects')}
+    report['classes'] = {name: int(count) for name, count in zip(class_names, summary['classes'])}
+    report['histograms'] = {name: counts.tolist() for name, counts in summary['histograms'].items()}
+    report['objects_per_image'] = {str(count): int(images) for count, images in enumerate(summary['objects_per_image'])
+                                   if images}
+    report['issues'] = summary['issues']
+    return report
+
+def validate_dataset(dataset_dir, workers=None, check_images=False, overlap_iou=0.5, fail_on_overlap=False,
+                     show_progress=True):
+    if not os.path.isdir(dataset_dir):
+        print(f"Error: dataset directory {dataset_dir} does not exist")
+        return None
+    class_names = dataset_class_names(dataset_dir)
+    num_classes = len(class_names)
+    shards_dir = os.path.join(dataset_dir, 'shards')
+    layout = 'shards' if os.path.isdir(shards_dir) else 'files'
+    split_summaries = {}
+    tasks = []
+    if layout == 'shards':
+        for split, shards in load_shard_index(shards_dir).items():
+            split_summaries[split] = empty_summary(num_classes)
+            tasks.extend((split, scan_shard, (os.path.join(shards_dir, shard['shard']), num_classes, overlap_iou,
+                                               check_images)) for shard in shards)
+    else:
+        for split in sorted(os.listdir(dataset_dir)):
+            if os.path.isdir(os.path.join(dataset_dir, split, 'labels')) or \
+                    os.path.isdir(os.path.join(dataset_dir, split, 'images')):
+                split_summaries[split] = summary = empty_summary(num_classes)
+                tasks.extend((split, scan_files, task) for task in
+                             file_tasks(dataset_dir, split, summary, num_classes, overlap_iou, check_images))
+        if not split_summaries:
+            print(f"Error: {dataset_dir} has neither a shards directory nor any <split>/images or <split>/labels")
+            return None
+
+    with Pool(workers) as pool:
+        results = pool.imap_unordered(run_task, tasks)
+        for split, summary in tqdm(results, total=len(tasks), disable=not show_progress):
+            merge_summary(split_summaries[split], summary)
+
+    total = empty_summary(num_classes)
+    for summary in split_summaries.values():
+        merge_summary(total, summary)
+    report = {'dataset': os.path.abspath(dataset_dir), 'layout': layout, 'images_checked': check_images,
+              'overlap_iou': overlap_iou}
+    report.update(summary_report(total, class_names))
+    report['splits'] = {split: {name: summary[name] for name in ('images', 'labels', 'objects')}
+                        for split, summary in split_summaries.items()}
+    failing = error_issues + (['overlaps'] if fail_on_overlap else [])
+    report['passed'] = not any(issue in report['issues'] for issue in failing)
+    return report
+
+def run_task(task):
+    split, scan, arguments = task
+    return split, scan(arguments)
+
+def format_report(report):
+    lines = [f"{report['dataset']} ({report['layout']}): {report['images']} images, {report['labels']} labels, "
+             f"{report['objects']} objects"]
+    for split, counts in report['splits'].items():
+        lines.append(f"  {split}: {counts['images']} images, {counts['labels']} labels, {counts['objects']} objects")
+    lines.append("Classes:")
+    for name, count in report['classes'].items():
+        lines.append(f"  {name:<14} {count}")
+    if not report['issues']:
+        lines.append("No issues found")
+    for issue, entry in report['issues'].items():
+        severity = 'error' if issue in error_issues else 'warning'
+        lines.append(f"{severity}: {issue}: {entry['count']} (e.g. {', '.join(entry['examples'][:5])})")
+    lines.append("PASSED" if report['passed'] else "FAILED")
+    return "\n".join(lines)
+
+def write_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)